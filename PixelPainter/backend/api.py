@@ -1,12 +1,19 @@
 import os
-import subprocess
-import glob
-import shutil
-import datetime
-from fastapi import FastAPI
-from pydantic import BaseModel
+import threading
+import time
+from collections import OrderedDict
+from typing import Literal, Optional
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, Response
+from pydantic import BaseModel, Field
+from PIL import Image
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.staticfiles import StaticFiles
+
+import generate_steps
+from bundles import build_bundle, pack_images
+from frames import FRAME_FORMATS, FrameEncoder, FrameStore, decode_frame, frame_name, is_frame_name
+from jobs import JobManager, QueueFull
+from result_cache import ResultCache, derive_seed, result_key
 
 app = FastAPI()
 
@@ -19,84 +26,378 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# REAL steps directory is backend/steps
+# REAL steps directory is backend/steps (content-addressed frames live in steps/objects)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STEPS_DIR = os.path.join(BASE_DIR, "steps")
+FRAMES_DIR = os.path.join(STEPS_DIR, "objects")
+
+# ---- job system settings ----
+MAX_WORKERS = int(os.environ.get("PIXELPAINTER_WORKERS", "2"))
+GPU_BUDGET_MB = int(os.environ.get("PIXELPAINTER_GPU_BUDGET_MB", "8000"))
+RETENTION_SECONDS = int(os.environ.get("PIXELPAINTER_RETENTION_SECONDS", "1800"))
+MAX_QUEUE = int(os.environ.get("PIXELPAINTER_MAX_QUEUE", "32"))
+# compatible jobs arriving within the window share one UNet call per step
+MAX_BATCH_SIZE = int(os.environ.get("PIXELPAINTER_MAX_BATCH", "4"))
+BATCH_WINDOW_MS = int(os.environ.get("PIXELPAINTER_BATCH_WINDOW_MS", "50"))
+
+# ---- frame serving settings ----
+ENCODER_WORKERS = int(os.environ.get("PIXELPAINTER_ENCODER_WORKERS", "2"))
+FRAME_MEMORY_MB = int(os.environ.get("PIXELPAINTER_FRAME_MEMORY_MB", "256"))
+# write-behind copy in steps/objects/ so frames outlive the in-memory LRU
+PERSIST_FRAMES = os.environ.get("PIXELPAINTER_PERSIST_FRAMES", "1") == "1"
+# unreferenced frame files younger than this are never collected
+FRAME_GC_GRACE_SECONDS = int(os.environ.get("PIXELPAINTER_FRAME_GC_GRACE_SECONDS", "300"))
+FRAME_GC_INTERVAL_SECONDS = 60
+# frame names are content hashes, so a URL's bytes never change
+FRAME_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# ---- result cache (finished frame sequences, content-addressed) ----
+RESULT_CACHE_DIR = os.environ.get("PIXELPAINTER_RESULT_CACHE_DIR") or os.path.join(BASE_DIR, "cache", "results")
+RESULT_CACHE_MB = int(os.environ.get("PIXELPAINTER_RESULT_CACHE_MB", "512"))
 
-print("SERVING STATIC FROM:", STEPS_DIR)
+# ---- forward noising (training demo) ----
+# finished sequences are remembered (and kept from frame GC) for RETENTION_SECONDS
+FORWARD_CACHE_ENTRIES = 64
+# largest source image accepted (matches Prompt.resolution's limit)
+FORWARD_MAX_SIDE = 1024
+# guards _forward_bundles only; runs happen outside it
+_forward_lock = threading.Lock()
+_forward_bundles = OrderedDict()   # request key → (created_at, bundle index)
 
-# Serve backend/steps to frontend
-app.mount("/static", StaticFiles(directory=STEPS_DIR), name="static")
+# torch.Generator.manual_seed rejects seeds that do not fit in 64 bits
+MAX_SEED = 2 ** 63 - 1
+
+store = FrameStore(FRAMES_DIR, max_memory_bytes=FRAME_MEMORY_MB * 1024 * 1024, persist=PERSIST_FRAMES)
+encoder = FrameEncoder(max_workers=ENCODER_WORKERS)
+results = ResultCache(RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MB * 1024 * 1024)
 
 
 class Prompt(BaseModel):
     prompt: str
+    negative_prompt: str = ""
+    # quality knobs (jobs with equal steps / resolution / scheduler can share a batch)
+    steps: int = Field(generate_steps.NUM_STEPS, ge=1, le=100)
+    resolution: int = Field(generate_steps.RESOLUTION, ge=128, le=1024, multiple_of=64)
+    scheduler: Literal["pndm", "ddim", "euler", "euler_a", "dpm"] = generate_steps.SCHEDULER
+    guidance_scale: float = Field(generate_steps.GUIDANCE_SCALE, ge=0, le=30)
+    # None = derived from the prompt, so repeated prompts give (cached) repeat images
+    seed: Optional[int] = Field(None, ge=0, le=MAX_SEED)
+    # how intermediate frames are decoded (final frame is always a full VAE decode)
+    preview: Literal["full", "linear", "taesd"] = generate_steps.PREVIEW_MODE
+    full_decode_every: int = Field(generate_steps.FULL_DECODE_EVERY, ge=0)
+    # how frames are compressed for the browser
+    frame_format: Literal["webp", "jpeg", "png"] = "webp"
+    frame_quality: int = Field(85, ge=1, le=100)
+    # also pack all frames into one sprite sheet or animated WebP
+    bundle: Optional[Literal["sprite", "webp"]] = None
+
+
+class ForwardRequest(BaseModel):
+    # a live job's step frame, e.g. its last entry in "frames"
+    frame: str
+    frames: int = Field(generate_steps.FORWARD_FRAMES, ge=2, le=60)
+    preview: Literal["full", "linear", "taesd"] = "full"
+    seed: int = Field(0, ge=0, le=MAX_SEED)
+    bundle: Literal["sprite", "webp"] = "sprite"
+    frame_quality: int = Field(85, ge=1, le=100)
+
 
-def _select_start_mid_final(sorted_files):
-    count = len(sorted_files)
-    if count == 0:
+def _denoise_request(job, futures):
+    fmt = job.params["frame_format"]
+    quality = job.params["frame_quality"]
+
+    def on_frame(i, frame):
+        futures.append(encoder.submit(
+            frame, fmt, quality,
+            on_done=lambda data, i=i: job.add_frame(i, store.put(data, fmt)),
+        ))
+
+    return generate_steps.DenoiseRequest(
+        job.prompt,
+        negative_prompt=job.params["negative_prompt"],
+        preview=job.params["preview"],
+        full_decode_every=job.params["full_decode_every"],
+        guidance_scale=job.params["guidance_scale"],
+        seed=job.params["seed"],
+        should_cancel=job.cancel_event.is_set,
+        on_frame=on_frame,
+    )
+
+
+def _pack(params, frames):
+    """Pack frames (bytes, step order) into one object; returns (bytes, index) or None."""
+    kind = params.get("bundle")
+    if not kind or not frames:
         return None
-    start = sorted_files[0]
-    middle = sorted_files[count // 2]
-    final = sorted_files[-1]
-    return {"start": start, "middle": middle, "final": final}
+    return build_bundle(kind, frames, quality=params["frame_quality"])
 
-@app.post("/generate")
-def generate_image(data: Prompt):
-    prompt = data.prompt
-
-    # 1) Collect existing frames (if any)
-    existing = sorted(glob.glob(f"{STEPS_DIR}/*.png"))
-    existing = sorted(existing)
-
-    prev_info = None
-    prev_dir = os.path.join(STEPS_DIR, "prev")
-    os.makedirs(prev_dir, exist_ok=True)
-
-    if existing:
-        # 2) Pick start/middle/final from existing frames
-        sel = _select_start_mid_final(existing)
-        if sel:
-            # Clear previous folder contents (so only these three files remain)
-            for f in glob.glob(os.path.join(prev_dir, "*")):
-                try:
-                    if os.path.isfile(f):
-                        os.remove(f)
-                    else:
-                        shutil.rmtree(f)
-                except Exception:
-                    pass
-
-            # Copy selected files into prev folder with fixed names
-            try:
-                shutil.copy(sel["start"], os.path.join(prev_dir, "start.png"))
-                shutil.copy(sel["middle"], os.path.join(prev_dir, "middle.png"))
-                shutil.copy(sel["final"], os.path.join(prev_dir, "final.png"))
-                prev_info = {
-                    "start": "prev/start.png",
-                    "middle": "prev/middle.png",
-                    "final": "prev/final.png",
-                }
-            except Exception as e:
-                # If copy fails, ignore but log
-                print("Warning: failed to copy previous selection:", e)
-
-    # 3) Delete existing frames (so generator can write fresh files)
-    for f in existing:
+
+def _publish(bundle):
+    """Put a packed bundle in the frame store; returns its index with the URL."""
+    if bundle is None:
+        return None
+    data, index = bundle
+    return {**index, "url": f"frames/{store.put(data, 'webp')}"}
+
+
+def _finish_job(job, frames):
+    """Pack the job's bundle and store its result; runs on an encoder thread."""
+    try:
+        bundle = _pack(job.params, [data for _, data in frames])
+        results.put(
+            job.params["cache_key"], frames, FRAME_FORMATS[job.params["frame_format"]][1], job.params,
+            bundles={job.params["bundle"]: bundle} if bundle else None,
+        )
+        job.bundle = _publish(bundle)
+    except Exception as e:
+        print(f"Warning: finishing job {job.id} failed:", e)
+    finally:
+        job.finishing = False
+
+
+def _run_batch(batch):
+    futures = {job.id: [] for job in batch}
+    requests = [_denoise_request(job, futures[job.id]) for job in batch]
+    # batch members share steps / resolution / scheduler (see batch_key)
+    params = batch[0].params
+    generate_steps.generate_batch(
+        requests,
+        num_steps=params["steps"],
+        latent_size=generate_steps.latent_size_for(params["resolution"]),
+        scheduler=params["scheduler"],
+    )
+
+    # the GPU is already free here; only wait for the encoders to catch up.
+    # Packing and the result-cache write go to the encoder pool, so the worker
+    # releases the batch's GPU budget and takes the next one right away
+    for job, req in zip(batch, requests):
+        fmt = job.params["frame_format"]
+        frames = [(frame_name(data, fmt), data) for data in (f.result() for f in futures[job.id])]
+        if not req.cancelled and frames:
+            job.finishing = True
+            encoder.run(_finish_job, job, frames)
+
+
+jobs = JobManager(
+    _run_batch,
+    max_workers=MAX_WORKERS,
+    gpu_budget_mb=GPU_BUDGET_MB,
+    retention_seconds=RETENTION_SECONDS,
+    max_queue=MAX_QUEUE,
+    max_batch_size=MAX_BATCH_SIZE,
+    batch_window_seconds=BATCH_WINDOW_MS / 1000,
+)
+
+
+def _forward_referenced():
+    cutoff = time.time() - RETENTION_SECONDS
+    with _forward_lock:
+        for key in [k for k, (created, _) in _forward_bundles.items() if created < cutoff]:
+            del _forward_bundles[key]
+        return {index["url"].rsplit("/", 1)[-1] for _, index in _forward_bundles.values()}
+
+
+def _frame_gc():
+    while True:
+        time.sleep(FRAME_GC_INTERVAL_SECONDS)
+        try:
+            store.gc(jobs.referenced_frames() | _forward_referenced(), FRAME_GC_GRACE_SECONDS)
+        except Exception as e:
+            print("Warning: frame GC failed:", e)
+
+
+@app.on_event("startup")
+def start_jobs():
+    jobs.start()
+    threading.Thread(target=_frame_gc, name="frame-gc", daemon=True).start()
+
+
+def _job_response(job):
+    resp = job.to_dict()
+    resp["queue_position"] = jobs.queue_position(job)
+    return resp
+
+
+def _get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="unknown job")
+    return job
+
+
+def _from_cache(prompt, params):
+    """Finished job for a cached result (frames loaded into the frame store), or None."""
+    hit = results.get(params["cache_key"])
+    if hit is None:
+        return None
+    entry, manifest = hit
+    frames = []
+    try:
+        for filename in manifest["frames"]:
+            with open(os.path.join(entry, filename), "rb") as f:
+                frames.append(f.read())
+    except OSError:
+        return None   # evicted meanwhile; generate it again
+    names = [store.put(data, params["frame_format"]) for data in frames]
+
+    # packed bundles are stored with the result; only pack a kind not seen before
+    kind = params.get("bundle")
+    bundle = None
+    cached = manifest.get("bundles", {}).get(kind) if kind else None
+    if cached is not None:
         try:
-            os.remove(f)
-        except Exception:
+            with open(os.path.join(entry, cached["file"]), "rb") as f:
+                bundle = (f.read(), cached["index"])
+        except OSError:
             pass
+    if bundle is None:
+        bundle = _pack(params, frames)
+        if bundle is not None:
+            results.add_bundle(params["cache_key"], kind, *bundle)
+    return jobs.add_finished(prompt, names, params, bundle=_publish(bundle))
 
-    # 4) Run generator (same as before)
-    subprocess.run(
-        ["python", "generate_steps.py"] + prompt.split(),
-        cwd=BASE_DIR,
+
+@app.post("/generate")
+def generate_image(data: Prompt):
+    """
+    Queue a generation and return its job id; poll /jobs/{job_id} for frames.
+    Repeats of a finished generation come straight from the result cache
+    (status "done", "cached": true) in the same response shape.
+    """
+    latent_size = generate_steps.latent_size_for(data.resolution)
+    params = {
+        "negative_prompt": data.negative_prompt,
+        "steps": data.steps,
+        "resolution": data.resolution,
+        "scheduler": data.scheduler,
+        "guidance_scale": data.guidance_scale,
+        "seed": data.seed if data.seed is not None else derive_seed(data.prompt),
+        "preview": data.preview,
+        "full_decode_every": data.full_decode_every,
+        "frame_format": data.frame_format,
+        "frame_quality": data.frame_quality,
+    }
+    params["cache_key"] = result_key(
+        model=generate_steps.MODEL_PATH,
+        device=generate_steps.DEVICE_TYPE,
+        dtype=str(generate_steps.DTYPE),
+        prompt=data.prompt,
+        **params,
     )
+    # packing is derived from the frames, so it is not part of the cache key
+    params["bundle"] = data.bundle
+
+    job = _from_cache(data.prompt, params)
+    if job is not None:
+        return _job_response(job)
+
+    try:
+        job = jobs.submit(
+            data.prompt,
+            generate_steps.estimate_job_memory_mb(latent_size),
+            batch_key=generate_steps.batch_key(data.steps, latent_size, data.scheduler),
+            params=params,
+        )
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=f"queue is full: {e}")
+    return _job_response(job)
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    return _job_response(_get_job(job_id))
+
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    _get_job(job_id)
+    return _job_response(jobs.cancel(job_id))
+
+
+@app.get("/frames/{name}")
+def frame(name: str, request: Request):
+    """
+    Serve a content-addressed frame (memory first, then disk). The name is
+    the hash of the bytes, so the response carries a strong ETag and may be
+    cached forever by browsers and proxies.
+    """
+    if not is_frame_name(name):
+        raise HTTPException(status_code=404, detail="frame not found")
+
+    etag = '"' + name.split(".")[0] + '"'
+    headers = {"ETag": etag, "Cache-Control": FRAME_CACHE_CONTROL}
+    media_type = FRAME_FORMATS[name.split(".")[1]][1]
+
+    if_none_match = request.headers.get("if-none-match", "")
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    if etag in tags or "*" in tags:
+        return Response(status_code=304, headers=headers)
+
+    data = store.get(name)
+    if data is not None:
+        return Response(content=data, media_type=media_type, headers=headers)
+
+    path = store.path(name)
+    if os.path.isfile(path):
+        return FileResponse(path, media_type=media_type, headers=headers)
+    raise HTTPException(status_code=404, detail="frame not found")
+
+
+def _read_frame(name):
+    data = store.get(name)
+    if data is not None:
+        return data
+    try:
+        with open(store.path(name), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+@app.post("/forward")
+def forward_noise(data: ForwardRequest):
+    """
+    Forward (training) diffusion of a job's frame with the model's real
+    noise schedule: one VAE encode, one batched add_noise over all
+    timesteps, batched decodes. Returns a bundle index (url + frame offsets)
+    plus the timesteps shown, like a job's "bundle".
+    """
+    name = data.frame.rsplit("/", 1)[-1]
+    key = (name, data.frames, data.preview, data.seed, data.bundle, data.frame_quality)
+    with _forward_lock:
+        hit = _forward_bundles.get(key)
+        if hit is not None:
+            _forward_bundles.move_to_end(key)
+            return hit[1]
+
+    # only step frames of live jobs, never bundles or other stored objects
+    image = _read_frame(name) if jobs.has_frame(name) else None
+    if image is None:
+        raise HTTPException(status_code=404, detail="frame not found")
+    array = decode_frame(image)
+    side = max(array.shape[:2])
+    if side > FORWARD_MAX_SIDE:
+        raise HTTPException(status_code=413, detail=f"frame is larger than {FORWARD_MAX_SIDE}px")
 
-    # 5) Collect generated images
-    files = sorted(glob.glob(f"{STEPS_DIR}/*.png"))
-    filenames = [os.path.basename(f) for f in files]
+    pending = []
+    memory_mb = generate_steps.estimate_forward_memory_mb(generate_steps.latent_size_for(side), data.frames)
+    # counted against the same GPU budget as generation batches
+    with jobs.reserve(memory_mb):
+        timesteps = generate_steps.forward_noise(
+            array,
+            num_frames=data.frames,
+            preview=data.preview,
+            seed=data.seed,
+            on_frame=lambda i, frame: pending.append(frame),
+        )
+    images = [Image.fromarray(frame.numpy()) for frame in pending]
+    bundle, index = pack_images(data.bundle, images, quality=data.frame_quality)
+    index["url"] = f"frames/{store.put(bundle, 'webp')}"
+    index["source"] = f"frames/{name}"
+    index["timesteps"] = timesteps
 
-    # 6) Return both current frames and previous selection (if any)
-    return {"frames": filenames, "previous": prev_info}
\ No newline at end of file
+    with _forward_lock:
+        _forward_bundles[key] = (time.time(), index)
+        while len(_forward_bundles) > FORWARD_CACHE_ENTRIES:
+            _forward_bundles.popitem(last=False)
+    return index
@@ -0,0 +1,330 @@
+"""
+Offline benchmark / profiling harness for the diffusion path.
+
+Runs on the CPU with the tiny randomly initialised pipeline by default
+(see tiny_pipeline.py), so it works on any machine and in CI:
+
+    python benchmark.py --steps 4,10 --resolution 128,256 --batch 1,2,4 --out bench.json
+    python benchmark.py --mode api --batch 1,4
+    python benchmark.py --model ../sd15 --device cuda --dtype fp16
+
+inprocess: calls generate_steps.generate_batch directly and times every
+           stage of every step (encode_prompt, unet, scheduler_step,
+           preview_decode / vae_decode, transfer, encode).
+api:       drives the FastAPI app end to end through TestClient
+           (POST /generate, poll /jobs/{id}, GET every frame), so queueing,
+           batching, encoding and serving overhead is included.
+
+Every (steps, resolution, batch) combination is run --warmup + --repeats
+times; the report has latency percentiles, peak memory and encoded frame
+bytes per combination (api mode adds bytes written to disk). Diff the
+JSON of two commits to compare them.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:   # Windows
+    resource = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PROMPTS = [
+    "A cute kitten playing with yarn",
+    "Colorful flowers in a garden",
+    "A happy puppy in a field",
+    "Sunset over mountains",
+    "Butterflies in a meadow",
+    "A cozy cabin in snow",
+    "Rainbow over hills",
+    "Dolphins jumping in ocean",
+]
+
+JOB_POLL_SECONDS = 0.01
+# stages that run every denoising step (decodes: preview or full, one per step);
+# "load", "encode_prompt" and "encode" are per run / per frame, see their mean_ms
+STEP_STAGES = ("unet", "scheduler_step", "preview_decode", "vae_decode", "transfer")
+
+
+def _ints(text):
+    return [int(v) for v in text.split(",") if v.strip()]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", default="inprocess", choices=["inprocess", "api", "both"])
+    parser.add_argument("--model", default="tiny", help='model folder, or "tiny" (default)')
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--dtype", default=None, choices=["fp16", "bf16", "fp32"])
+    parser.add_argument("--steps", type=_ints, default=[4, 10], help="comma separated sweep")
+    parser.add_argument("--resolution", type=_ints, default=[128, 256], help="comma separated sweep")
+    parser.add_argument("--batch", type=_ints, default=[1, 2, 4], help="comma separated sweep")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--scheduler", default="pndm")
+    parser.add_argument("--preview", default="linear", choices=["full", "linear", "taesd"])
+    parser.add_argument("--frame-format", default="webp", choices=["webp", "jpeg", "png"])
+    parser.add_argument("--frame-quality", type=int, default=85)
+    parser.add_argument("--text-cache", default="cold", choices=["cold", "warm"],
+                        help="cold = fresh prompt-embedding cache every run, so encode_prompt is measured")
+    parser.add_argument("--out", default=None, help="write the JSON report here instead of stdout")
+    return parser.parse_args()
+
+
+def _configure(args):
+    # generate_steps / api read their settings at import time
+    os.environ["PIXELPAINTER_MODEL_PATH"] = args.model
+    os.environ["PIXELPAINTER_DEVICE"] = args.device
+    if args.dtype:
+        os.environ["PIXELPAINTER_DTYPE"] = args.dtype
+
+
+# ---- measurements ----
+def _reset_peak_memory(gs):
+    import torch
+    if gs.DEVICE_TYPE == "cuda":
+        torch.cuda.reset_peak_memory_stats()
+
+
+def _peak_memory(gs):
+    import torch
+    memory = {}
+    if resource is not None:
+        # process-wide high-water mark (KB on Linux); it never goes down
+        memory["rss_peak_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    if gs.DEVICE_TYPE == "cuda":
+        memory["cuda_peak_mb"] = round(torch.cuda.max_memory_allocated() / 2 ** 20, 1)
+    return memory
+
+
+def _dir_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _metadata(gs):
+    import torch
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "model": gs.MODEL_PATH,
+        "device": gs.DEVICE,
+        "dtype": str(gs.DTYPE),
+        "threads": torch.get_num_threads(),
+    }
+
+
+# ---- in-process ----
+def run_inprocess(gs, args, steps, resolution, batch, seeds):
+    from frames import encode_frame
+    from profiling import StageTimer, summarize
+    from text_cache import PromptEmbeddingCache
+
+    latent_size = gs.latent_size_for(resolution)
+    timer = StageTimer(sync=gs.DEVICE_TYPE == "cuda")
+    latencies = []
+    frames = 0
+    bytes_encoded = 0
+    timesteps = 0
+    _reset_peak_memory(gs)
+
+    for run in range(args.warmup + args.repeats):
+        measured = run >= args.warmup
+        run_timer = timer if measured else StageTimer()
+        if args.text_cache == "cold":
+            gs.text_cache = PromptEmbeddingCache(gs.MODEL_PATH, gs.TEXT_CACHE_MB * 1024 * 1024)
+
+        pending = []
+        requests = [
+            gs.DenoiseRequest(
+                PROMPTS[(run * batch + k) % len(PROMPTS)],
+                preview=args.preview,
+                seed=next(seeds),
+                on_frame=lambda i, frame: pending.append(frame),
+            )
+            for k in range(batch)
+        ]
+
+        start = time.perf_counter()
+        gs.generate_batch(requests, steps, latent_size, args.scheduler, timer=run_timer)
+        # what the encoder pool does off the loop: wait for the copy, compress
+        nbytes = 0
+        for frame in pending:
+            with run_timer.stage("encode"):
+                nbytes += len(encode_frame(frame.numpy(), args.frame_format, args.frame_quality))
+        elapsed = time.perf_counter() - start
+
+        if measured:
+            latencies.append(elapsed)
+            frames += len(pending)
+            bytes_encoded += nbytes
+            # PNDM runs steps + 1 timesteps; count what the scheduler really did
+            timesteps += len(requests[0].scheduler.timesteps)
+
+    stages = timer.summary()
+    return {
+        "mode": "inprocess",
+        "steps": steps,
+        "resolution": resolution,
+        "batch": batch,
+        "repeats": args.repeats,
+        "latency": summarize(latencies),
+        "images_per_s": round(batch * len(latencies) / sum(latencies), 3),
+        "stages": stages,
+        "timesteps": timesteps,
+        "per_step_ms": {name: round(s["total_ms"] / timesteps, 3)
+                        for name, s in stages.items() if name in STEP_STAGES},
+        "frames": frames,
+        # frames are only encoded in memory here; nothing goes to disk
+        "bytes_encoded": bytes_encoded,
+        "memory": _peak_memory(gs),
+    }
+
+
+# ---- end to end through the FastAPI app ----
+def run_api(gs, client, args, steps, resolution, batch, seeds, cache_dir):
+    from profiling import summarize
+
+    job_latencies = []
+    round_latencies = []
+    fetch_times = []
+    frames = 0
+    bytes_served = 0
+    disk_before = _dir_bytes(cache_dir)
+    _reset_peak_memory(gs)
+
+    for run in range(args.warmup + args.repeats):
+        measured = run >= args.warmup
+        start = time.perf_counter()
+        pending = {}
+        for k in range(batch):
+            job = client.post("/generate", json={
+                "prompt": PROMPTS[(run * batch + k) % len(PROMPTS)],
+                "steps": steps,
+                "resolution": resolution,
+                "scheduler": args.scheduler,
+                "preview": args.preview,
+                # a fresh seed every job, so nothing comes from the result cache
+                "seed": next(seeds),
+                "frame_format": args.frame_format,
+                "frame_quality": args.frame_quality,
+            }).json()
+            pending[job["job_id"]] = job
+
+        done = []
+        while pending:
+            time.sleep(JOB_POLL_SECONDS)
+            for job_id in list(pending):
+                job = client.get(f"/jobs/{job_id}").json()
+                # "finishing": bundle packing / result-cache write still running
+                if job["status"] in ("queued", "running") or job.get("finishing"):
+                    continue
+                if job["status"] != "done":
+                    raise RuntimeError(f"job {job_id} {job['status']}: {job.get('error')}")
+                del pending[job_id]
+                done.append(job)
+                if measured:
+                    job_latencies.append(time.perf_counter() - start)
+
+        for job in done:
+            for url in job["frames"]:
+                t0 = time.perf_counter()
+                resp = client.get(f"/{url}")
+                resp.raise_for_status()
+                if measured:
+                    fetch_times.append(time.perf_counter() - t0)
+                    bytes_served += len(resp.content)
+                    frames += 1
+        if measured:
+            round_latencies.append(time.perf_counter() - start)
+
+    return {
+        "mode": "api",
+        "steps": steps,
+        "resolution": resolution,
+        "batch": batch,
+        "repeats": args.repeats,
+        "latency": summarize(round_latencies),
+        "job_latency": summarize(job_latencies),
+        "frame_fetch": summarize(fetch_times),
+        "images_per_s": round(batch * len(round_latencies) / sum(round_latencies), 3),
+        "frames": frames,
+        "bytes_served": bytes_served,
+        # every served frame was encoded once, so this matches inprocess mode
+        "bytes_encoded": bytes_served,
+        "bytes_written": _dir_bytes(cache_dir) - disk_before,
+        "memory": _peak_memory(gs),
+    }
+
+
+def main():
+    args = parse_args()
+    _configure(args)
+    import generate_steps as gs
+
+    sweep = list(itertools.product(args.steps, args.resolution, args.batch))
+    seeds = itertools.count(int(time.time()))
+    report = {"meta": _metadata(gs), "args": vars(args), "results": []}
+
+    start = time.perf_counter()
+    gs.load_pipeline()
+    report["load_s"] = round(time.perf_counter() - start, 3)
+
+    if args.mode in ("inprocess", "both"):
+        for steps, resolution, batch in sweep:
+            result = run_inprocess(gs, args, steps, resolution, batch, seeds)
+            report["results"].append(result)
+            print(f"inprocess steps={steps} res={resolution} batch={batch}: "
+                  f"p50 {result['latency']['p50_ms']} ms", file=sys.stderr)
+
+    if args.mode in ("api", "both"):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            os.environ["PIXELPAINTER_RESULT_CACHE_DIR"] = cache_dir
+            # frames stay in memory; the result cache is the only disk writer
+            os.environ["PIXELPAINTER_PERSIST_FRAMES"] = "0"
+            os.environ["PIXELPAINTER_MAX_BATCH"] = str(max(args.batch))
+            from fastapi.testclient import TestClient
+            import api
+
+            with TestClient(api.app) as client:
+                for steps, resolution, batch in sweep:
+                    result = run_api(gs, client, args, steps, resolution, batch, seeds, cache_dir)
+                    report["results"].append(result)
+                    print(f"api steps={steps} res={resolution} batch={batch}: "
+                          f"p50 {result['latency']['p50_ms']} ms", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+        print("Report written to", args.out, file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Throughput of cross-request batched denoising vs. running the same prompts
+back to back.
+
+    python benchmark_batching.py --jobs 4 --steps 10
+
+Both modes run the same prompts with the same settings; frames are pulled to
+host memory (but not encoded) so the device→host copies are included.
+"""
+import argparse
+import json
+import time
+import torch
+
+import generate_steps
+
+PROMPTS = [
+    "A cute kitten playing with yarn",
+    "Colorful flowers in a garden",
+    "A happy puppy in a field",
+    "Sunset over mountains",
+    "Butterflies in a meadow",
+    "A cozy cabin in snow",
+    "Rainbow over hills",
+    "Dolphins jumping in ocean",
+]
+
+
+def _sync():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def _requests(prompts, preview, frames):
+    return [
+        generate_steps.DenoiseRequest(
+            p, preview=preview,
+            on_frame=lambda i, frame: frames.append(frame.numpy()),
+        )
+        for p in prompts
+    ]
+
+
+def run_sequential(prompts, num_steps, latent_size, preview):
+    frames = []
+    _sync()
+    start = time.perf_counter()
+    for req in _requests(prompts, preview, frames):
+        generate_steps.generate_batch([req], num_steps, latent_size)
+    _sync()
+    return time.perf_counter() - start, len(frames)
+
+
+def run_batched(prompts, num_steps, latent_size, preview, max_batch):
+    frames = []
+    requests = _requests(prompts, preview, frames)
+    _sync()
+    start = time.perf_counter()
+    for k in range(0, len(requests), max_batch):
+        generate_steps.generate_batch(requests[k:k + max_batch], num_steps, latent_size)
+    _sync()
+    return time.perf_counter() - start, len(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=4, help="number of concurrent prompts")
+    parser.add_argument("--max-batch", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=generate_steps.NUM_STEPS)
+    parser.add_argument("--latent-size", type=int, default=generate_steps.LATENT_SIZE)
+    parser.add_argument("--preview", default=generate_steps.PREVIEW_MODE, choices=["full", "linear", "taesd"])
+    parser.add_argument("--repeats", type=int, default=2)
+    args = parser.parse_args()
+
+    prompts = [PROMPTS[i % len(PROMPTS)] for i in range(args.jobs)]
+
+    # warm-up: load weights, pick kernels
+    generate_steps.load_pipeline()
+    run_batched(prompts[:1], 2, args.latent_size, args.preview, 1)
+
+    results = {"sequential": [], "batched": []}
+    for _ in range(args.repeats):
+        results["sequential"].append(run_sequential(prompts, args.steps, args.latent_size, args.preview)[0])
+        results["batched"].append(
+            run_batched(prompts, args.steps, args.latent_size, args.preview, args.max_batch)[0]
+        )
+
+    seq = min(results["sequential"])
+    bat = min(results["batched"])
+    report = {
+        "jobs": args.jobs,
+        "max_batch": args.max_batch,
+        "steps": args.steps,
+        "latent_size": args.latent_size,
+        "preview": args.preview,
+        "sequential_s": round(seq, 3),
+        "batched_s": round(bat, 3),
+        "sequential_images_per_s": round(args.jobs / seq, 3),
+        "batched_images_per_s": round(args.jobs / bat, 3),
+        "speedup": round(seq / bat, 2),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import io
+import math
+from PIL import Image
+
+BUNDLE_KINDS = ("sprite", "webp")
+
+# matches the frontend's playback interval
+FRAME_DURATION_MS = 700
+
+# WebP's hard limit per side
+WEBP_MAX_SIDE = 16383
+
+
+def _decode(frames):
+    return [Image.open(io.BytesIO(data)).convert("RGB") for data in frames]
+
+
+def sprite_sheet(images, quality=80, duration_ms=FRAME_DURATION_MS):
+    """
+    Pack frames into one near-square WebP atlas.
+    Returns (bytes, index) where index lists every frame's offset and timing.
+    """
+    w, h = images[0].size
+    columns = min(len(images), max(1, math.ceil(math.sqrt(len(images)))), WEBP_MAX_SIDE // w)
+    rows = math.ceil(len(images) / columns)
+
+    sheet = Image.new("RGB", (columns * w, rows * h))
+    entries = []
+    for i, image in enumerate(images):
+        x, y = (i % columns) * w, (i // columns) * h
+        sheet.paste(image, (x, y))
+        entries.append({"x": x, "y": y, "offset_ms": i * duration_ms, "duration_ms": duration_ms})
+
+    buf = io.BytesIO()
+    sheet.save(buf, format="WEBP", quality=quality, method=4)
+    index = {
+        "kind": "sprite",
+        "media_type": "image/webp",
+        "frame_width": w,
+        "frame_height": h,
+        "columns": columns,
+        "rows": rows,
+        "frames": entries,
+    }
+    return buf.getvalue(), index
+
+
+def animated_webp(images, quality=80, duration_ms=FRAME_DURATION_MS):
+    """Encode frames as one looping animated WebP. Returns (bytes, index)."""
+    w, h = images[0].size
+    buf = io.BytesIO()
+    images[0].save(
+        buf,
+        format="WEBP",
+        save_all=True,
+        append_images=images[1:],
+        duration=duration_ms,
+        loop=0,
+        quality=quality,
+        method=4,
+    )
+    index = {
+        "kind": "webp",
+        "media_type": "image/webp",
+        "frame_width": w,
+        "frame_height": h,
+        "loop": 0,
+        "frames": [
+            {"offset_ms": i * duration_ms, "duration_ms": duration_ms}
+            for i in range(len(images))
+        ],
+    }
+    return buf.getvalue(), index
+
+
+def pack_images(kind, images, quality=80, duration_ms=FRAME_DURATION_MS):
+    """Pack PIL images (in order) as a "sprite" sheet or animated "webp"."""
+    if kind == "sprite":
+        return sprite_sheet(images, quality, duration_ms)
+    return animated_webp(images, quality, duration_ms)
+
+
+def build_bundle(kind, frames, quality=80, duration_ms=FRAME_DURATION_MS):
+    """
+    Pack a job's encoded frames (bytes, in step order) into a single object
+    so a client fetches one compressed file per generation instead of N.
+    """
+    return pack_images(kind, _decode(frames), quality, duration_ms)
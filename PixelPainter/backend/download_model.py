@@ -1,4 +1,4 @@
-from diffusers import StableDiffusionPipeline
+from diffusers import AutoencoderTiny, StableDiffusionPipeline
 import torch
 
 print("Downloading model...")
@@ -11,3 +11,15 @@ pipe = StableDiffusionPipeline.from_pretrained(
 pipe.save_pretrained("sd15")
 
 print("Model downloaded and saved!")
+
+# tiny autoencoder used for cheap intermediate previews (preview="taesd")
+print("Downloading TAESD preview decoder...")
+
+taesd = AutoencoderTiny.from_pretrained(
+    "madebyollin/taesd",
+    torch_dtype=torch.float16
+)
+
+taesd.save_pretrained("taesd")
+
+print("TAESD downloaded and saved!")
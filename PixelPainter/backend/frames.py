@@ -0,0 +1,184 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from PIL import Image
+
+# format name → (PIL format, media type)
+FRAME_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+
+
+class PendingFrame:
+    """A uint8 HWC frame whose device→host copy may still be in flight."""
+
+    def __init__(self, host, ready=None):
+        self.host = host
+        self.ready = ready
+
+    def numpy(self):
+        # only the encoder thread blocks here, never the denoising loop
+        if self.ready is not None:
+            self.ready.synchronize()
+        return self.host.numpy()
+
+
+def to_host_async(decoded):
+    """
+    Turn a decoded [1, 3, H, W] image in [-1, 1] into uint8 HWC on the device
+    (4x fewer bytes to move than float32) and start a non-blocking copy into
+    pinned host memory. Returns immediately with a PendingFrame.
+    """
+    image = ((decoded[0].float().clamp(-1, 1) + 1) * 127.5).round().to(torch.uint8)
+    image = image.permute(1, 2, 0).contiguous()
+    if image.device.type != "cuda":
+        return PendingFrame(image)
+
+    host = torch.empty(image.shape, dtype=torch.uint8, pin_memory=True)
+    host.copy_(image, non_blocking=True)
+    ready = torch.cuda.Event()
+    ready.record()
+    return PendingFrame(host, ready)
+
+
+def encode_frame(array, fmt="webp", quality=85):
+    """Compress an HWC uint8 array to WebP / JPEG / PNG bytes."""
+    pil_format, _ = FRAME_FORMATS[fmt]
+    image = Image.fromarray(array)
+    buf = io.BytesIO()
+    if fmt == "png":
+        # PNG is lossless; quality does not apply, favour speed over size
+        image.save(buf, format=pil_format, compress_level=1)
+    else:
+        image.save(buf, format=pil_format, quality=quality)
+    return buf.getvalue()
+
+
+def decode_frame(data):
+    """Encoded frame bytes back to an HWC uint8 RGB array."""
+    return np.asarray(Image.open(io.BytesIO(data)).convert("RGB"))
+
+
+def frame_name(data, fmt):
+    """Immutable, content-addressed name of an encoded frame: <sha256[:32]>.<fmt>."""
+    return f"{hashlib.sha256(data).hexdigest()[:32]}.{fmt}"
+
+
+def is_frame_name(name):
+    digest, _, ext = name.partition(".")
+    return len(digest) == 32 and ext in FRAME_FORMATS and all(c in "0123456789abcdef" for c in digest)
+
+
+class FrameStore:
+    """
+    Content-addressed store of encoded frames.
+
+    Frames are named by the hash of their bytes (see frame_name), so a name
+    always means the same image: identical frames are stored once, and
+    browsers and proxies can cache them forever. Recent frames are kept in a
+    byte-bounded in-memory LRU; with `persist`, every frame is also written
+    once to <root>/<hash[:2]>/<name>. Nothing is ever overwritten; gc()
+    removes files that no job references any more.
+    """
+
+    def __init__(self, root, max_memory_bytes, persist=True):
+        self.root = root
+        self.max_memory_bytes = max_memory_bytes
+        self.persist = persist
+        self._frames = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.root, name[:2], name)
+
+    def put(self, data, fmt):
+        """Store encoded frame bytes and return their name."""
+        name = frame_name(data, fmt)
+        with self._lock:
+            if name in self._frames:
+                self._frames.move_to_end(name)
+            else:
+                self._frames[name] = data
+                self._bytes += len(data)
+                while self._bytes > self.max_memory_bytes and len(self._frames) > 1:
+                    _, dropped = self._frames.popitem(last=False)
+                    self._bytes -= len(dropped)
+
+        if self.persist:
+            path = self.path(name)
+            if os.path.exists(path):
+                # refresh mtime so gc's grace period restarts for reused frames
+                os.utime(path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f"{path}.tmp-{threading.get_ident()}"
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+        return name
+
+    def get(self, name):
+        """Frame bytes from memory, or None (check path(name) on disk next)."""
+        with self._lock:
+            data = self._frames.get(name)
+            if data is not None:
+                self._frames.move_to_end(name)
+            return data
+
+    def gc(self, referenced, min_age_seconds):
+        """
+        Delete frame files that are not in `referenced` and were not written
+        or reused for `min_age_seconds` (the grace period covers frames whose
+        job has not recorded them yet). The in-memory LRU bounds itself.
+        Returns the number of files removed.
+        """
+        removed = 0
+        cutoff = time.time() - min_age_seconds
+        for shard in os.listdir(self.root):
+            shard_dir = os.path.join(self.root, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                path = os.path.join(shard_dir, name)
+                try:
+                    if name not in referenced and os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+class FrameEncoder:
+    """
+    Thread pool that waits for device→host copies and compresses frames, so
+    the denoising loop never waits on image compression or the filesystem.
+    on_done(data) runs on the encoder thread (e.g. to put the bytes in a
+    FrameStore); the returned future resolves to the encoded bytes.
+    """
+
+    def __init__(self, max_workers=2):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="frame-encoder")
+
+    def submit(self, pending, fmt="webp", quality=85, on_done=None):
+        return self._pool.submit(self._encode, pending, fmt, quality, on_done)
+
+    def run(self, fn, *args):
+        """Run other CPU-side work of finished jobs (packing, disk writes) on the pool."""
+        return self._pool.submit(fn, *args)
+
+    def _encode(self, pending, fmt, quality, on_done):
+        data = encode_frame(pending.numpy(), fmt, quality)
+        if on_done is not None:
+            on_done(data)
+        return data
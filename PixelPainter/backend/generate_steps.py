@@ -1,88 +1,452 @@
 import sys
 import torch
 import os
-from diffusers import StableDiffusionPipeline
-from PIL import Image
+import inspect
+import threading
+from contextlib import nullcontext
+from diffusers import (
+    DDIMScheduler,
+    DDPMScheduler,
+    DPMSolverMultistepScheduler,
+    EulerAncestralDiscreteScheduler,
+    EulerDiscreteScheduler,
+    PNDMScheduler,
+    StableDiffusionPipeline,
+)
 
-# get the prompt
-prompt = " ".join(sys.argv[1:])
+from frames import FrameEncoder, to_host_async
+from previews import loaded_taesd, needs_full_decode, preview_decode
+from profiling import NULL_TIMER
+from text_cache import PromptEmbeddingCache
 
-# load local model
-MODEL_PATH = "../sd15"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-pipe = StableDiffusionPipeline.from_pretrained(
-    MODEL_PATH,
-    torch_dtype=torch.float16,
-    local_files_only=True
-)
+# load local model ("tiny" = randomly initialised test pipeline, see tiny_pipeline.py)
+MODEL_PATH = os.environ.get("PIXELPAINTER_MODEL_PATH") or os.path.join(BASE_DIR, "..", "sd15")
 
-pipe = pipe.to("cuda")
-pipe.set_progress_bar_config(disable=True)
+# ---- DEVICE / PRECISION ----
+# cuda if available, otherwise CPU. On CPU, fp16 is slow; use fp32 or bf16
+# (bf16 is fast on CPUs with AVX512-BF16 / AMX).
+DTYPES = {"fp16": torch.float16, "bf16": torch.bfloat16, "fp32": torch.float32}
 
-# output folder
-os.makedirs("steps", exist_ok=True)
+DEVICE = os.environ.get("PIXELPAINTER_DEVICE") or ("cuda" if torch.cuda.is_available() else "cpu")
+DEVICE_TYPE = torch.device(DEVICE).type
+DTYPE = DTYPES[os.environ.get("PIXELPAINTER_DTYPE") or ("fp16" if DEVICE_TYPE == "cuda" else "fp32")]
+# intra-op threads for CPU inference (0 = torch default, one per physical core)
+CPU_THREADS = int(os.environ.get("PIXELPAINTER_CPU_THREADS", "0"))
 
 # ---- REDUCED DIFFUSION STEPS ----
-num_steps = 10   # reduced from 30 → MUCH lower VRAM
-pipe.scheduler.set_timesteps(num_steps, device="cuda")
-
-# encode text prompt
-prompt_embeds, negative_embeds = pipe.encode_prompt(
-    prompt=prompt,
-    device="cuda",
-    num_images_per_prompt=1,
-    do_classifier_free_guidance=True
-)
+NUM_STEPS = 10   # reduced from 30 → MUCH lower VRAM
 
 # ---- REDUCED RESOLUTION (384×384) ----
-latent_size = 48   # 48 × 8 = 384px output resolution
+VAE_SCALE_FACTOR = 8
+RESOLUTION = 384
+LATENT_SIZE = RESOLUTION // VAE_SCALE_FACTOR   # 48 × 8 = 384px output resolution
+
+GUIDANCE_SCALE = 7.5
+
+# scheduler name → diffusers class (all built from the model's scheduler config)
+SCHEDULERS = {
+    "pndm": PNDMScheduler,
+    "ddim": DDIMScheduler,
+    "euler": EulerDiscreteScheduler,
+    "euler_a": EulerAncestralDiscreteScheduler,
+    "dpm": DPMSolverMultistepScheduler,
+}
+SCHEDULER = "pndm"   # SD1.5 default
+
+# Intermediate frames use a cheap latent preview; the full VAE decode only
+# runs for the final frame (and every FULL_DECODE_EVERY-th step if > 0).
+PREVIEW_MODE = "linear"
+FULL_DECODE_EVERY = 0
+
+# Rough per-job activation cost (UNet batch of 2 + VAE decode) at 384×384, fp16.
+# The model weights are shared by every job and are not part of this number.
+JOB_BASE_MEMORY_MB = 1200
+
+# ---- FORWARD NOISING (training-side demo) ----
+FORWARD_FRAMES = 20
+# latents decoded per VAE call; bounds activation memory for long sequences
+FORWARD_DECODE_BATCH = int(os.environ.get("PIXELPAINTER_FORWARD_DECODE_BATCH", "8"))
+# Rough VAE encode/decode activation cost per image at 384×384, fp16.
+VAE_IMAGE_MEMORY_MB = 300
+
+# ---- TEXT ENCODER CACHE ----
+TEXT_CACHE_MB = int(os.environ.get("PIXELPAINTER_TEXT_CACHE_MB", "64"))
+# set to a folder to keep prompt embeddings across restarts
+TEXT_CACHE_DIR = os.environ.get("PIXELPAINTER_TEXT_CACHE_DIR") or None
+
+_pipe = None
+_pipe_lock = threading.Lock()
+
+# Entered around every batch / forward run. A multi-model host (see
+# host/serve.py) swaps in a guard that keeps the pipeline resident on DEVICE
+# while it is in use; on its own PixelPainter never offloads, so it does nothing.
+residency_guard = nullcontext
+
+text_cache = PromptEmbeddingCache(MODEL_PATH, TEXT_CACHE_MB * 1024 * 1024, TEXT_CACHE_DIR)
+
+
+class GenerationCancelled(Exception):
+    """Raised from the denoising loop when the caller asked to stop."""
+
+
+def load_pipeline():
+    """Load the pipeline once per process; every job shares the same weights."""
+    global _pipe
+    with _pipe_lock:
+        if _pipe is None:
+            if MODEL_PATH == "tiny":
+                from tiny_pipeline import build_tiny_pipeline
+                pipe = build_tiny_pipeline(DTYPE)
+            else:
+                pipe = StableDiffusionPipeline.from_pretrained(
+                    MODEL_PATH,
+                    torch_dtype=DTYPE,
+                    local_files_only=True
+                )
+
+            pipe = pipe.to(DEVICE)
+            pipe.set_progress_bar_config(disable=True)
+
+            # Safety: disable gradients (faster)
+            for module in (pipe.unet, pipe.vae, pipe.text_encoder):
+                module.eval()
+                for p in module.parameters():
+                    p.requires_grad_(False)
+
+            if DEVICE_TYPE == "cpu":
+                # oneDNN convolutions are faster on NHWC tensors
+                pipe.unet.to(memory_format=torch.channels_last)
+                pipe.vae.to(memory_format=torch.channels_last)
+                if CPU_THREADS > 0:
+                    torch.set_num_threads(CPU_THREADS)
+
+            _pipe = pipe
+    return _pipe
+
+
+def _move_state(device):
+    # everything PixelPainter keeps on the device besides the pipeline
+    taesd = loaded_taesd()
+    if taesd is not None:
+        taesd.to(device)
+    text_cache.to(device)
+
+
+def offload_pipeline(device="cpu"):
+    """
+    Move the loaded weights off DEVICE so another model can use the memory,
+    together with the TAESD preview decoder and cached prompt embeddings.
+    """
+    with _pipe_lock:
+        if _pipe is not None:
+            _pipe.to(device)
+        _move_state(device)
+
+
+def restore_pipeline():
+    """Load the pipeline, or move offloaded weights back onto DEVICE."""
+    pipe = load_pipeline()
+    with _pipe_lock:
+        pipe.to(DEVICE)
+        _move_state(DEVICE)
+    return pipe
+
+
+def latent_size_for(resolution):
+    return resolution // VAE_SCALE_FACTOR
+
+
+def estimate_job_memory_mb(latent_size=LATENT_SIZE):
+    """Activation memory a single job needs on the GPU, scaled by resolution."""
+    return int(JOB_BASE_MEMORY_MB * (latent_size / LATENT_SIZE) ** 2)
+
+
+def estimate_forward_memory_mb(latent_size=LATENT_SIZE, num_frames=FORWARD_FRAMES):
+    """GPU memory a forward_noise run needs: one decode batch of VAE activations."""
+    images = min(num_frames, FORWARD_DECODE_BATCH)
+    return int(VAE_IMAGE_MEMORY_MB * images * (latent_size / LATENT_SIZE) ** 2)
+
+
+def batch_key(num_steps=NUM_STEPS, latent_size=LATENT_SIZE, scheduler=SCHEDULER):
+    """Jobs with the same key can share UNet calls (same latent shape and timesteps)."""
+    return (latent_size, num_steps, scheduler)
+
+
+def _autocast():
+    # weights are already in DTYPE; autocast keeps mixed ops in that precision too
+    return torch.autocast(DEVICE_TYPE, dtype=DTYPE, enabled=DTYPE != torch.float32)
 
-latents = torch.randn(
-    (1, pipe.unet.config.in_channels, latent_size, latent_size),
-    device="cuda",
-    dtype=torch.float16
-)
 
-guidance_scale = 7.5
+def make_scheduler(pipe, name=SCHEDULER):
+    """A fresh scheduler instance of the requested kind, from the model's config."""
+    return SCHEDULERS[name].from_config(pipe.scheduler.config)
 
-# Safety: disable VAE gradients (faster)
-pipe.vae.eval()
-for p in pipe.vae.parameters():
-    p.requires_grad_(False)
 
-# ---- DIFFUSION LOOP ----
-for i, t in enumerate(pipe.scheduler.timesteps):
+def initial_latents(pipe, latent_size, seed=None):
+    """
+    Starting noise. Drawn on the CPU from a seeded generator so a given seed
+    produces the same image on every device.
+    """
+    generator = torch.Generator("cpu")
+    if seed is None:
+        generator.seed()
+    else:
+        generator.manual_seed(seed)
+    latents = torch.randn(
+        (1, pipe.unet.config.in_channels, latent_size, latent_size),
+        generator=generator,
+        dtype=torch.float32
+    )
+    return latents.to(DEVICE, DTYPE), generator
 
-    # classifier-free guidance requires 2 copies
-    latent_input = torch.cat([latents] * 2)
 
-    # forward UNet
-    with torch.amp.autocast("cuda"):
-        noise_pred = pipe.unet(
-            latent_input,
-            t,
-            encoder_hidden_states=torch.cat([negative_embeds, prompt_embeds])
-        ).sample
+class DenoiseRequest:
+    """
+    One job's share of a (possibly batched) denoising run.
 
-    # CFG combine noise
-    noise_uncond, noise_text = noise_pred.chunk(2)
-    noise_pred = noise_uncond + guidance_scale * (noise_text - noise_uncond)
+    preview:           "full" (VAE decode every step), "linear" (latent→RGB
+                       projection) or "taesd" (tiny autoencoder) for
+                       intermediate frames. The final frame is always a full decode.
+    full_decode_every: also run the full VAE on every N-th step (0 = never).
+    negative_prompt:   text to steer away from; "" uses the cached empty-prompt
+                       (unconditional) embedding.
+    seed:              seed for the starting noise (and ancestral schedulers);
+                       None draws a random one.
+    should_cancel:     optional callable checked before every step.
+    on_frame:          callback(step_index, PendingFrame) for every step. The frame's
+                       device→host copy is still in flight; encode it off the loop
+                       (see frames.FrameEncoder) so the GPU never waits on PIL or disk.
+    """
 
-    # update latents
-    latents = pipe.scheduler.step(noise_pred, t, latents).prev_sample
+    def __init__(self, prompt, guidance_scale=GUIDANCE_SCALE, preview=PREVIEW_MODE,
+                 full_decode_every=FULL_DECODE_EVERY, seed=None, should_cancel=None,
+                 on_frame=None, negative_prompt=""):
+        self.prompt = prompt
+        self.negative_prompt = negative_prompt
+        self.guidance_scale = guidance_scale
+        self.preview = preview
+        self.full_decode_every = full_decode_every
+        self.seed = seed
+        self.should_cancel = should_cancel
+        self.on_frame = on_frame
+        self.cancelled = False
+
+        # filled in by generate_batch
+        self.scheduler = None
+        self.prompt_embeds = None
+        self.negative_embeds = None
+        self.latents = None
+        self.generator = None
+
+    def emit(self, step_index, decoded):
+        if self.on_frame is not None:
+            self.on_frame(step_index, to_host_async(decoded))
+
+
+def generate_batch(requests, num_steps=NUM_STEPS, latent_size=LATENT_SIZE, scheduler=SCHEDULER,
+                   timer=NULL_TIMER):
+    """
+    Denoise several compatible requests together (see batch_key).
+
+    Every timestep runs ONE UNet call over all active requests: latents and
+    text embeddings are stacked as [uncond_1..n, text_1..n]. Guidance and the
+    scheduler step are then applied per request (each has its own guidance
+    scale and scheduler state), and frames are split back out per request.
+    Requests whose should_cancel() turns True are dropped from the batch
+    (req.cancelled is set) while the rest carry on.
+
+    timer (see profiling.StageTimer) is charged per stage: "load",
+    "encode_prompt", "unet", "scheduler_step", "preview_decode",
+    "vae_decode" and "transfer" (start of the device→host copy).
+    """
+    with residency_guard():
+        _denoise_batch(requests, num_steps, latent_size, scheduler, timer)
+
+
+def _denoise_batch(requests, num_steps, latent_size, scheduler, timer):
+    with timer.stage("load"):
+        pipe = load_pipeline()
 
-    # ---- DECODE the image ----
     with torch.no_grad():
-        with torch.amp.autocast("cuda"):
-            decoded = pipe.vae.decode(latents / 0.18215).sample
+        for req in requests:
+            # Each request gets its own scheduler: set_timesteps() and multistep
+            # history are per-instance state that must not be shared.
+            req.scheduler = make_scheduler(pipe, scheduler)
+            req.scheduler.set_timesteps(num_steps, device=DEVICE)
+
+            # encode text prompt (cached; the empty-prompt negative is encoded once)
+            with timer.stage("encode_prompt"):
+                req.prompt_embeds = text_cache.get(pipe, req.prompt, DEVICE)
+                if req.negative_prompt.strip():
+                    req.negative_embeds = text_cache.get(pipe, req.negative_prompt, DEVICE)
+                else:
+                    req.negative_embeds = text_cache.uncond(pipe, DEVICE)
+
+            req.latents, req.generator = initial_latents(pipe, latent_size, req.seed)
+            req.latents = req.latents * req.scheduler.init_noise_sigma
+
+        # ancestral schedulers draw fresh noise every step; keep it seeded too
+        step_takes_generator = "generator" in inspect.signature(requests[0].scheduler.step).parameters
+        vae_scale = pipe.vae.config.scaling_factor
+
+        active = list(requests)
+
+        # ---- DIFFUSION LOOP ----
+        # PNDM with skip_prk_steps yields num_steps + 1 timesteps; the final
+        # frame is the last timestep, not step num_steps - 1
+        timesteps = requests[0].scheduler.timesteps
+        for i, t in enumerate(timesteps):
+            for req in active:
+                if req.should_cancel is not None and req.should_cancel():
+                    req.cancelled = True
+            active = [req for req in active if not req.cancelled]
+            if not active:
+                break
+
+            # classifier-free guidance requires 2 copies of every job's latents
+            latents = torch.cat([req.scheduler.scale_model_input(req.latents, t) for req in active])
+            latent_input = torch.cat([latents] * 2)
+            text_embeds = torch.cat(
+                [req.negative_embeds for req in active] + [req.prompt_embeds for req in active]
+            )
+
+            # forward UNet (one call for the whole batch)
+            with timer.stage("unet"), _autocast():
+                noise_pred = pipe.unet(
+                    latent_input,
+                    t,
+                    encoder_hidden_states=text_embeds
+                ).sample
+
+            noise_uncond, noise_text = noise_pred.chunk(2)
+
+            full = []
+            for j, req in enumerate(active):
+                # CFG combine noise (per job guidance scale)
+                uncond = noise_uncond[j:j + 1]
+                pred = uncond + req.guidance_scale * (noise_text[j:j + 1] - uncond)
+
+                # update latents
+                extra = {"generator": req.generator} if step_takes_generator else {}
+                with timer.stage("scheduler_step"):
+                    req.latents = req.scheduler.step(pred, t, req.latents, **extra).prev_sample
+
+                # ---- DECODE the image ----
+                if needs_full_decode(req.preview, i, len(timesteps), req.full_decode_every):
+                    full.append(req)
+                else:
+                    with timer.stage("preview_decode"):
+                        preview = preview_decode(req.preview, req.latents, pipe.vae_scale_factor)
+                    with timer.stage("transfer"):
+                        req.emit(i, preview)
 
-        # format to real image
-        image = (decoded.detach().float().cpu().clamp(-1, 1) + 1) / 2
-        image = image.permute(0, 2, 3, 1)[0].numpy()
-        image = (image * 255).astype("uint8")
-        image = Image.fromarray(image)
+            # jobs that need the real VAE this step share one decode call
+            if full:
+                with timer.stage("vae_decode"), _autocast():
+                    decoded = pipe.vae.decode(torch.cat([req.latents for req in full]) / vae_scale).sample
+                for j, req in enumerate(full):
+                    with timer.stage("transfer"):
+                        req.emit(i, decoded[j:j + 1])
+
+
+def generate(prompt, num_steps=NUM_STEPS, latent_size=LATENT_SIZE,
+             guidance_scale=GUIDANCE_SCALE, preview=PREVIEW_MODE,
+             full_decode_every=FULL_DECODE_EVERY, scheduler=SCHEDULER, seed=None,
+             should_cancel=None, on_frame=None, negative_prompt=""):
+    """
+    Run the denoising loop for one prompt (a batch of one) and hand every
+    step's image to on_frame. See DenoiseRequest for the arguments; raises
+    GenerationCancelled if should_cancel() turned True.
+    """
+    req = DenoiseRequest(prompt, guidance_scale, preview, full_decode_every, seed,
+                         should_cancel, on_frame, negative_prompt)
+    generate_batch([req], num_steps, latent_size, scheduler)
+    if req.cancelled:
+        raise GenerationCancelled()
+
+
+def forward_timesteps(scheduler, num_frames=FORWARD_FRAMES):
+    """Training timesteps spread evenly from lightly noised to pure noise."""
+    total = scheduler.config.num_train_timesteps
+    return torch.tensor([(i + 1) * total // num_frames - 1 for i in range(num_frames)])
+
+
+def forward_noise(image, num_frames=FORWARD_FRAMES, preview="full", seed=0, on_frame=None):
+    """
+    The forward (training) diffusion process for one image: what the model
+    is taught to undo.
+
+    image is an HWC uint8 RGB array (e.g. a job's final frame). It is
+    encoded with the VAE once; scheduler.add_noise then noises that latent
+    to every timestep in ONE batched op, sharing a single seeded noise draw
+    so the frames blend smoothly into the same noise. Results are decoded in
+    batches of FORWARD_DECODE_BATCH ("full") or with the cheap latent
+    preview ("linear" / "taesd"). on_frame(frame_index, PendingFrame) gets
+    every frame; returns the timesteps used.
+    """
+    with residency_guard(), torch.no_grad():
+        pipe = load_pipeline()
+        # DDPM's add_noise is the exact q(x_t | x_0) SD was trained with
+        scheduler = DDPMScheduler.from_config(pipe.scheduler.config)
+        timesteps = forward_timesteps(scheduler, num_frames)
+        vae_scale = pipe.vae.config.scaling_factor
+
+        x = torch.from_numpy(image.copy()).permute(2, 0, 1).unsqueeze(0).float() / 127.5 - 1
+        h, w = x.shape[-2:]
+        x = x[..., :h - h % VAE_SCALE_FACTOR, :w - w % VAE_SCALE_FACTOR]
+        x = x.to(DEVICE, DTYPE)
+        if DEVICE_TYPE == "cpu":
+            x = x.contiguous(memory_format=torch.channels_last)
+
+        # ---- ENCODE once (mean of the latent distribution: deterministic) ----
+        with _autocast():
+            latents = pipe.vae.encode(x).latent_dist.mean * vae_scale
+
+        generator = torch.Generator("cpu").manual_seed(seed)
+        noise = torch.randn(latents.shape, generator=generator, dtype=torch.float32).to(DEVICE, DTYPE)
+
+        # ---- NOISE to every timestep at once ----
+        shape = (num_frames, *latents.shape[1:])
+        noisy = scheduler.add_noise(latents.expand(shape), noise.expand(shape), timesteps.to(DEVICE))
+
+        # ---- DECODE ----
+        for start in range(0, num_frames, FORWARD_DECODE_BATCH):
+            chunk = noisy[start:start + FORWARD_DECODE_BATCH]
+            if preview == "full":
+                with _autocast():
+                    decoded = pipe.vae.decode(chunk / vae_scale).sample
+            else:
+                decoded = preview_decode(preview, chunk, pipe.vae_scale_factor)
+            if on_frame is not None:
+                for j in range(decoded.shape[0]):
+                    on_frame(start + j, to_host_async(decoded[j:j + 1]))
+
+    return timesteps.tolist()
+
+
+if __name__ == "__main__":
+    # get the prompt
+    prompt = " ".join(sys.argv[1:])
+
+    # output folder
+    out_dir = os.path.join(BASE_DIR, "steps")
+    os.makedirs(out_dir, exist_ok=True)
+    encoder = FrameEncoder()
+    futures = []
+
+    def write(path, data):
+        with open(path, "wb") as f:
+            f.write(data)
 
     # save each step
-    image.save(f"steps/step_{i:03}.png")
+    def save(i, frame):
+        path = os.path.join(out_dir, f"step_{i:03}.png")
+        futures.append(encoder.submit(frame, "png", on_done=lambda data, path=path: write(path, data)))
+
+    generate(prompt, on_frame=save)
+    for f in futures:
+        f.result()
 
-print("✓ All 10 steps generated successfully!")
+    print(f"✓ All {len(futures)} steps generated successfully!")
@@ -0,0 +1,331 @@
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class QueueFull(Exception):
+    """Raised by JobManager.submit when the pending queue is at capacity."""
+
+
+class Job:
+    def __init__(self, prompt, memory_mb, params=None, batch_key=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.prompt = prompt
+        self.params = params or {}
+        self.cached = False
+        self.memory_mb = memory_mb
+        # jobs with equal (non-None) keys may be denoised in one batch
+        self.batch_key = batch_key
+        self.status = QUEUED
+        self._frames = {}
+        # optional packed copy of all frames (see bundles.py): index + "url"
+        self.bundle = None
+        # done jobs are packed and written to the result cache off the worker;
+        # True until that has finished (bundle is set by then)
+        self.finishing = False
+        self.previous = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    def add_frame(self, index, name):
+        # frames finish encoding out of order; keep them keyed by step index.
+        # names are content hashes (see frames.FrameStore), served at /frames/<name>
+        self._frames[index] = f"frames/{name}"
+
+    @property
+    def frames(self):
+        frames = dict(self._frames)  # encoder threads add frames concurrently
+        return [frames[i] for i in sorted(frames)]
+
+    def selection(self):
+        """Start / middle / final frames of this job (None if it has no frames)."""
+        frames = self.frames
+        count = len(frames)
+        if count == 0:
+            return None
+        return {
+            "start": frames[0],
+            "middle": frames[count // 2],
+            "final": frames[-1],
+        }
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "cached": self.cached,
+            "prompt": self.prompt,
+            "frames": self.frames,
+            "bundle": self.bundle,
+            "finishing": self.finishing,
+            "previous": self.previous,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    Queue of generation jobs drained by a bounded pool of worker threads,
+    with compatible jobs grouped into batches.
+
+    Jobs only hold references to content-addressed frames, so concurrent jobs
+    never touch each other's frames. Before a job starts, a worker reserves the
+    job's estimated GPU memory against `gpu_budget_mb`; if the budget is used
+    up the worker waits until running jobs release theirs. A job larger than
+    the whole budget still runs, but only when nothing else is running.
+
+    A worker hands `run_batch` a list of jobs. Admission rules for joining the
+    head-of-queue job's batch:
+      - same non-None batch_key (same resolution / step count / scheduler),
+      - at most `max_batch_size` jobs per batch,
+      - the batch's summed memory must stay inside the budget,
+      - the worker waits at most `batch_window_seconds` for companions;
+        jobs queued later start a new batch.
+
+    Finished jobs are forgotten after `retention_seconds`, except the most
+    recently completed one, which still backs the "previous generation"
+    panel. referenced_frames() tells the frame store's GC what is still in use.
+    `on_expire(job)` is called for each removed job.
+    """
+
+    def __init__(self, run_batch, max_workers=2, gpu_budget_mb=8000,
+                 retention_seconds=1800, max_queue=32, on_expire=None,
+                 max_batch_size=4, batch_window_seconds=0.05):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.batch_window_seconds = batch_window_seconds
+        self.on_expire = on_expire
+        self.max_workers = max_workers
+        self.gpu_budget_mb = gpu_budget_mb
+        self.retention_seconds = retention_seconds
+        self.max_queue = max_queue
+
+        self._jobs = {}
+        self._queue = deque()
+        self._reserved_mb = 0
+        self._running = 0
+        self._last_done = None
+        self._cond = threading.Condition()
+        self._threads = []
+
+    # ---- lifecycle ----
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.max_workers):
+            th = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            th.start()
+            self._threads.append(th)
+        th = threading.Thread(target=self._janitor, name="job-janitor", daemon=True)
+        th.start()
+        self._threads.append(th)
+
+    # ---- public API ----
+    def submit(self, prompt, memory_mb, params=None, batch_key=None):
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                raise QueueFull(f"{len(self._queue)} jobs already waiting")
+            job = Job(prompt, memory_mb, params, batch_key)
+            if self._last_done is not None:
+                job.previous = self._last_done.selection()
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            self._cond.notify_all()
+        return job
+
+    def add_finished(self, prompt, frames, params=None, bundle=None):
+        """
+        Register a job that is complete on arrival (a result-cache hit).
+        frames: frame-store names in step order.
+        """
+        job = Job(prompt, 0, params)
+        job.cached = True
+        job.bundle = bundle
+        for i, name in enumerate(frames):
+            job.add_frame(i, name)
+        with self._cond:
+            if self._last_done is not None:
+                job.previous = self._last_done.selection()
+            job.started_at = job.created_at
+            self._jobs[job.id] = job
+            self._finish(job, DONE)
+        return job
+
+    @contextmanager
+    def reserve(self, memory_mb):
+        """
+        Hold `memory_mb` of the GPU budget for work that runs outside the job
+        queue (e.g. /forward); blocks until it fits next to running batches.
+        """
+        with self._cond:
+            while not (self._running == 0 or self._reserved_mb + memory_mb <= self.gpu_budget_mb):
+                self._cond.wait()
+            self._reserved_mb += memory_mb
+            self._running += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._reserved_mb -= memory_mb
+                self._running -= 1
+                self._cond.notify_all()
+
+    def has_frame(self, name):
+        """True if `name` is one of a live job's step frames (not a bundle)."""
+        with self._cond:
+            jobs = list(self._jobs.values())
+        return any(url.rsplit("/", 1)[-1] == name for job in jobs for url in job.frames)
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def queue_position(self, job):
+        with self._cond:
+            try:
+                return self._queue.index(job)
+            except ValueError:
+                return None
+
+    def cancel(self, job_id):
+        """Cancel a job. Queued jobs are dropped; running jobs stop at the next step."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status in FINISHED_STATES:
+                return job
+            job.cancel_event.set()
+            if job.status == QUEUED:
+                self._queue.remove(job)
+                self._finish(job, CANCELLED)
+            self._cond.notify_all()
+        return job
+
+    # ---- workers ----
+    def _fits(self, job):
+        return self._running == 0 or self._reserved_mb + job.memory_mb <= self.gpu_budget_mb
+
+    def _claim(self, job):
+        self._queue.remove(job)
+        self._reserved_mb += job.memory_mb
+        self._running += 1
+        job.status = RUNNING
+        job.started_at = time.time()
+
+    def _admit(self, batch):
+        """Move queued jobs that may join `batch` out of the queue; True if it is full."""
+        head = batch[0]
+        if head.batch_key is None:
+            return True
+        for job in list(self._queue):
+            if len(batch) >= self.max_batch_size:
+                break
+            if job.batch_key == head.batch_key and \
+                    self._reserved_mb + job.memory_mb <= self.gpu_budget_mb:
+                self._claim(job)
+                batch.append(job)
+        return len(batch) >= self.max_batch_size
+
+    def _take(self):
+        """
+        Block until the head of the queue fits in the memory budget, claim it,
+        then gather compatible jobs for up to batch_window_seconds.
+        """
+        with self._cond:
+            while not self._queue or not self._fits(self._queue[0]):
+                self._cond.wait()
+            batch = [self._queue[0]]
+            self._claim(batch[0])
+
+            deadline = time.time() + self.batch_window_seconds
+            while not self._admit(batch):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return batch
+
+    def _release(self, job, status, error=None):
+        with self._cond:
+            self._reserved_mb -= job.memory_mb
+            self._running -= 1
+            job.error = error
+            self._finish(job, status)
+            self._cond.notify_all()
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        if status == DONE:
+            self._last_done = job
+
+    def _worker(self):
+        while True:
+            batch = self._take()
+            try:
+                self.run_batch(batch)
+            except Exception as e:
+                print(f"Batch {[job.id for job in batch]} failed:", e)
+                for job in batch:
+                    if job.cancel_event.is_set():
+                        self._release(job, CANCELLED)
+                    else:
+                        self._release(job, FAILED, error=str(e))
+                continue
+            for job in batch:
+                self._release(job, CANCELLED if job.cancel_event.is_set() else DONE)
+
+    # ---- retention ----
+    def _expired(self, now):
+        with self._cond:
+            expired = [
+                job for job in self._jobs.values()
+                if job.status in FINISHED_STATES
+                and job is not self._last_done
+                and now - job.finished_at > self.retention_seconds
+            ]
+            for job in expired:
+                del self._jobs[job.id]
+        return expired
+
+    def referenced_frames(self):
+        """Names of every frame a live job (or its "previous" panel) points at."""
+        with self._cond:
+            jobs = list(self._jobs.values())
+        names = set()
+        for job in jobs:
+            urls = job.frames + list((job.previous or {}).values())
+            if job.bundle is not None:
+                urls.append(job.bundle["url"])
+            names.update(url.rsplit("/", 1)[-1] for url in urls)
+        return names
+
+    def cleanup(self):
+        for job in self._expired(time.time()):
+            if self.on_expire is not None:
+                self.on_expire(job)
+
+    def _janitor(self):
+        while True:
+            time.sleep(min(60, max(1, self.retention_seconds / 4)))
+            try:
+                self.cleanup()
+            except Exception as e:
+                print("Warning: job cleanup failed:", e)
@@ -0,0 +1,87 @@
+import os
+import threading
+import torch
+import torch.nn.functional as F
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# optional tiny autoencoder (madebyollin/taesd), fetched by download_model.py
+TAESD_PATH = os.path.join(BASE_DIR, "..", "taesd")
+
+PREVIEW_MODES = ("full", "linear", "taesd")
+
+# Linear map from the 4 SD1.x latent channels to RGB (roughly [-1, 1]).
+# Fitted against real VAE decodes; good enough to watch the image emerge.
+SD15_LATENT_RGB_FACTORS = [
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177],
+]
+
+_taesd = None
+_taesd_missing = False
+_taesd_lock = threading.Lock()
+
+
+def linear_preview(latents, scale_factor=8):
+    """
+    Project latents [B, 4, h, w] to RGB [B, 3, h*scale, w*scale] in [-1, 1].
+    One tiny matmul instead of a full VAE decode.
+    """
+    factors = torch.tensor(SD15_LATENT_RGB_FACTORS, device=latents.device, dtype=torch.float32)
+    rgb = torch.einsum("bchw,cr->brhw", latents.float(), factors)
+    if scale_factor > 1:
+        rgb = F.interpolate(rgb, scale_factor=scale_factor, mode="bilinear", align_corners=False)
+    return rgb.clamp(-1, 1)
+
+
+def load_taesd(device, dtype):
+    """Load the tiny autoencoder once; returns None if it is not downloaded."""
+    global _taesd, _taesd_missing
+    with _taesd_lock:
+        if _taesd is None and not _taesd_missing:
+            if not os.path.isdir(TAESD_PATH):
+                print("Warning: taesd not found at", TAESD_PATH, "- falling back to linear previews")
+                _taesd_missing = True
+                return None
+            from diffusers import AutoencoderTiny
+            taesd = AutoencoderTiny.from_pretrained(TAESD_PATH, torch_dtype=dtype, local_files_only=True)
+            taesd = taesd.to(device)
+            taesd.eval()
+            for p in taesd.parameters():
+                p.requires_grad_(False)
+            _taesd = taesd
+    return _taesd
+
+
+def loaded_taesd():
+    """The tiny autoencoder if it has been loaded, else None."""
+    with _taesd_lock:
+        return _taesd
+
+
+def taesd_preview(latents, scale_factor=8):
+    """Decode with the tiny autoencoder; falls back to the linear projection."""
+    taesd = load_taesd(latents.device, latents.dtype)
+    if taesd is None:
+        return linear_preview(latents, scale_factor)
+    # TAESD takes the unscaled pipeline latents and returns [-1, 1] images
+    return taesd.decode(latents).sample.float().clamp(-1, 1)
+
+
+def preview_decode(mode, latents, scale_factor=8):
+    if mode == "taesd":
+        return taesd_preview(latents, scale_factor)
+    return linear_preview(latents, scale_factor)
+
+
+def needs_full_decode(mode, step_index, num_steps, full_decode_every=0):
+    """
+    True when this step should go through the real VAE:
+    always in "full" mode, always for the final frame, and every N-th step
+    when full_decode_every > 0.
+    """
+    if mode == "full" or step_index == num_steps - 1:
+        return True
+    return full_decode_every > 0 and (step_index + 1) % full_decode_every == 0
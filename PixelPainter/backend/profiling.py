@@ -0,0 +1,74 @@
+import math
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+import torch
+
+
+def percentile(values, q):
+    """q-th percentile (0-100) of a list, linearly interpolated."""
+    if not values:
+        return None
+    values = sorted(values)
+    pos = (len(values) - 1) * q / 100
+    lo, hi = math.floor(pos), math.ceil(pos)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def summarize(seconds):
+    """count / total / mean / p50 / p90 / p99 of a list of durations, in ms."""
+    ms = [s * 1000 for s in seconds]
+    return {
+        "count": len(ms),
+        "total_ms": round(sum(ms), 3),
+        "mean_ms": round(sum(ms) / len(ms), 3) if ms else None,
+        "p50_ms": round(percentile(ms, 50), 3) if ms else None,
+        "p90_ms": round(percentile(ms, 90), 3) if ms else None,
+        "p99_ms": round(percentile(ms, 99), 3) if ms else None,
+    }
+
+
+class StageTimer:
+    """
+    Wall-clock time per named stage ("unet", "vae_decode", ...), one sample
+    per call. With `sync`, CUDA work is synchronized around every stage so
+    asynchronous kernels are charged to the stage that queued them.
+    Stages must not be nested.
+    """
+
+    def __init__(self, sync=False):
+        self.sync = sync
+        self.samples = defaultdict(list)
+
+    def _wait(self):
+        if self.sync:
+            torch.cuda.synchronize()
+
+    @contextmanager
+    def stage(self, name):
+        self._wait()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._wait()
+            self.samples[name].append(time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.samples[name].append(seconds)
+
+    def summary(self):
+        return {name: summarize(values) for name, values in self.samples.items()}
+
+
+class NullTimer:
+    """Default timer for production runs: records nothing."""
+
+    def stage(self, name):
+        return nullcontext()
+
+    def add(self, name, seconds):
+        pass
+
+
+NULL_TIMER = NullTimer()
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from text_cache import normalize_prompt
+
+MANIFEST = "manifest.json"
+
+
+def derive_seed(prompt):
+    """Stable seed for requests that do not pick one, so repeats can hit the cache."""
+    return zlib.crc32(normalize_prompt(prompt).encode("utf-8"))
+
+
+def result_key(**settings):
+    """
+    Content address of a generation: sha256 over every setting that changes
+    the frames (model, prompts, seed, steps, resolution, guidance, scheduler,
+    preview and encoding options).
+    """
+    for name in ("prompt", "negative_prompt"):
+        if name in settings:
+            settings[name] = normalize_prompt(settings[name])
+    blob = json.dumps(settings, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _bundle_file(kind):
+    return f"bundle-{kind}.webp"
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class ResultCache:
+    """
+    On-disk cache of finished frame sequences, one folder per result key:
+
+        <root>/<key[:2]>/<key>/manifest.json + frame files
+
+    Entries are written to a temp folder and renamed into place, so readers
+    never see half-written results. Total size is capped at `max_bytes`;
+    the least recently used entries are evicted first (recency survives
+    restarts through the manifest's mtime).
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key → size in bytes, oldest first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._scan()
+
+    def _dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _scan(self):
+        found = []
+        for shard in os.listdir(self.root):
+            shard_dir = os.path.join(self.root, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for key in os.listdir(shard_dir):
+                entry = os.path.join(shard_dir, key)
+                manifest = os.path.join(entry, MANIFEST)
+                if not os.path.isfile(manifest):
+                    # leftover temp folder from an interrupted write
+                    shutil.rmtree(entry, ignore_errors=True)
+                    continue
+                size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+                found.append((os.path.getmtime(manifest), key, size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._bytes += size
+        self._evict()
+
+    def get(self, key):
+        """Return (folder, manifest dict) for a cached result, or None."""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        entry = self._dir(key)
+        try:
+            with open(os.path.join(entry, MANIFEST), encoding="utf-8") as f:
+                manifest = json.load(f)
+            os.utime(os.path.join(entry, MANIFEST))
+        except OSError:
+            with self._lock:
+                self._bytes -= self._entries.pop(key, 0)
+            return None
+        return entry, manifest
+
+    def put(self, key, frames, media_type, settings=None, bundles=None):
+        """
+        Store a finished result; frames is a list of (filename, bytes) in step
+        order, bundles an optional {kind: (bytes, index)} of packed frames.
+        """
+        with self._lock:
+            if key in self._entries:
+                return
+        entry = self._dir(key)
+        tmp = f"{entry}.tmp-{os.getpid()}-{threading.get_ident()}"
+        os.makedirs(tmp, exist_ok=True)
+        size = 0
+        for filename, data in frames:
+            with open(os.path.join(tmp, filename), "wb") as f:
+                f.write(data)
+            size += len(data)
+        manifest = {
+            "frames": [filename for filename, _ in frames],
+            "media_type": media_type,
+            "settings": settings,
+            "bundles": {},
+            "created_at": time.time(),
+        }
+        for kind, (data, index) in (bundles or {}).items():
+            filename = _bundle_file(kind)
+            with open(os.path.join(tmp, filename), "wb") as f:
+                f.write(data)
+            size += len(data)
+            manifest["bundles"][kind] = {"file": filename, "index": index}
+        with open(os.path.join(tmp, MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        try:
+            os.replace(tmp, entry)
+        except OSError:
+            # another job stored the same key first
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        with self._lock:
+            self._entries[key] = size
+            self._bytes += size
+            self._evict()
+
+    def add_bundle(self, key, kind, data, index):
+        """Attach a packed bundle to an existing entry (no-op if it was evicted)."""
+        entry = self._dir(key)
+        filename = _bundle_file(kind)
+        with self._lock:
+            if key not in self._entries:
+                return
+            try:
+                with open(os.path.join(entry, MANIFEST), encoding="utf-8") as f:
+                    manifest = json.load(f)
+                if kind in manifest.setdefault("bundles", {}):
+                    return
+                _write_atomic(os.path.join(entry, filename), data)
+                manifest["bundles"][kind] = {"file": filename, "index": index}
+                _write_atomic(os.path.join(entry, MANIFEST), json.dumps(manifest).encode("utf-8"))
+            except OSError as e:
+                print("Warning: failed to cache bundle:", e)
+                return
+            self._entries[key] += len(data)
+            self._bytes += len(data)
+            self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            shutil.rmtree(self._dir(key), ignore_errors=True)
@@ -0,0 +1,137 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import torch
+
+
+def normalize_prompt(prompt):
+    # CLIP's tokenizer lowercases and collapses whitespace itself, so these
+    # prompts produce identical embeddings and can share one cache entry.
+    return " ".join(prompt.lower().split())
+
+
+class PromptEmbeddingCache:
+    """
+    Text-conditioning cache in front of the CLIP text encoder.
+
+    - The unconditional (empty prompt) embedding is computed once per model.
+    - Prompt embeddings live in an LRU keyed by normalized prompt text and
+      bounded by `max_bytes`; entries stay on the device they were encoded on.
+    - With `persist_dir`, entries are also saved to disk and reloaded after a
+      restart instead of running the text encoder again.
+
+    Cached tensors are shared between jobs and must be treated as read-only.
+    """
+
+    def __init__(self, model_id, max_bytes, persist_dir=None):
+        self.model_id = model_id
+        self.max_bytes = max_bytes
+        self.persist_dir = None
+        if persist_dir:
+            model_hash = hashlib.sha256(model_id.encode("utf-8")).hexdigest()[:16]
+            self.persist_dir = os.path.join(persist_dir, model_hash)
+            os.makedirs(self.persist_dir, exist_ok=True)
+
+        self._uncond = None
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # ---- encoding ----
+    @staticmethod
+    def _encode(pipe, text, device):
+        embeds, _ = pipe.encode_prompt(
+            prompt=text,
+            device=device,
+            num_images_per_prompt=1,
+            do_classifier_free_guidance=False
+        )
+        return embeds
+
+    def uncond(self, pipe, device):
+        """Embedding of the empty prompt (the CFG negative); encoded only once."""
+        with self._lock:
+            if self._uncond is not None:
+                return self._uncond
+        embeds = self._encode(pipe, "", device)
+        with self._lock:
+            if self._uncond is None:
+                self._uncond = embeds
+            return self._uncond
+
+    def get(self, pipe, prompt, device):
+        key = normalize_prompt(prompt)
+        with self._lock:
+            embeds = self._entries.get(key)
+            if embeds is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return embeds
+            self.misses += 1
+
+        embeds = self._load(key, device)
+        if embeds is None:
+            embeds = self._encode(pipe, key, device)
+            self._save(key, embeds)
+        self._put(key, embeds)
+        return embeds
+
+    # ---- LRU bookkeeping ----
+    def _put(self, key, embeds):
+        size = embeds.numel() * embeds.element_size()
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = embeds
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, dropped = self._entries.popitem(last=False)
+                self._bytes -= dropped.numel() * dropped.element_size()
+
+    def to(self, device):
+        """Move every in-memory embedding to `device` (see generate_steps.offload_pipeline)."""
+        with self._lock:
+            if self._uncond is not None:
+                self._uncond = self._uncond.to(device)
+            for key, embeds in self._entries.items():
+                self._entries[key] = embeds.to(device)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    # ---- disk persistence ----
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.persist_dir, f"{digest}.pt")
+
+    def _load(self, key, device):
+        if self.persist_dir is None:
+            return None
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            return torch.load(path, map_location=device)
+        except Exception as e:
+            print("Warning: dropping unreadable text-cache entry:", e)
+            return None
+
+    def _save(self, key, embeds):
+        if self.persist_dir is None:
+            return
+        path = self._path(key)
+        tmp = path + ".tmp"
+        try:
+            torch.save(embeds.detach().cpu(), tmp)
+            os.replace(tmp, path)
+        except Exception as e:
+            print("Warning: failed to persist text-cache entry:", e)
@@ -0,0 +1,139 @@
+"""
+Tiny, randomly initialised Stable Diffusion pipeline.
+
+Same structure as SD1.5 (CLIP text encoder → UNet with cross-attention →
+VAE with an 8x latent scale factor) but only a few MB of weights, so the
+whole generation path can run and be timed on a CPU-only machine or in CI.
+The images are noise, not art.
+
+Use it in-process with PIXELPAINTER_MODEL_PATH=tiny, or save it to disk:
+
+    python tiny_pipeline.py ../tiny-sd
+"""
+import json
+import os
+import sys
+import tempfile
+import torch
+from diffusers import AutoencoderKL, PNDMScheduler, StableDiffusionPipeline, UNet2DConditionModel
+from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+
+SEED = 0
+MAX_TOKENS = 77
+
+UNET_CONFIG = dict(
+    sample_size=48,
+    in_channels=4,
+    out_channels=4,
+    block_out_channels=(32, 64),
+    layers_per_block=1,
+    down_block_types=("CrossAttnDownBlock2D", "DownBlock2D"),
+    up_block_types=("UpBlock2D", "CrossAttnUpBlock2D"),
+    cross_attention_dim=32,
+    attention_head_dim=8,
+    norm_num_groups=32,
+)
+
+# four resolution levels → the same 8x latent scale factor as SD1.5
+VAE_CONFIG = dict(
+    in_channels=3,
+    out_channels=3,
+    latent_channels=4,
+    block_out_channels=(32, 32, 32, 32),
+    down_block_types=("DownEncoderBlock2D",) * 4,
+    up_block_types=("UpDecoderBlock2D",) * 4,
+    layers_per_block=1,
+    norm_num_groups=32,
+    scaling_factor=0.18215,
+)
+
+TEXT_CONFIG = dict(
+    hidden_size=32,
+    intermediate_size=37,
+    num_attention_heads=4,
+    num_hidden_layers=2,
+    max_position_embeddings=MAX_TOKENS,
+    layer_norm_eps=1e-05,
+)
+
+# SD1.5's scheduler settings
+SCHEDULER_CONFIG = dict(
+    beta_start=0.00085,
+    beta_end=0.012,
+    beta_schedule="scaled_linear",
+    num_train_timesteps=1000,
+    skip_prk_steps=True,
+    steps_offset=1,
+    set_alpha_to_one=False,
+)
+
+
+def bytes_to_unicode():
+    """
+    GPT-2 / CLIP byte → printable unicode character table (as used by
+    CLIPTokenizer's byte encoder). Kept here because transformers does not
+    export it publicly.
+    """
+    bs = (
+        list(range(ord("!"), ord("~") + 1))
+        + list(range(ord("¡"), ord("¬") + 1))
+        + list(range(ord("®"), ord("ÿ") + 1))
+    )
+    cs = bs[:]
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return dict(zip(bs, (chr(c) for c in cs)))
+
+
+def build_tokenizer():
+    """Character-level CLIP tokenizer: every byte is a token, no BPE merges."""
+    chars = list(bytes_to_unicode().values())
+    vocab = {}
+    for tok in ["<|startoftext|>", "<|endoftext|>"] + chars + [c + "</w>" for c in chars]:
+        vocab.setdefault(tok, len(vocab))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vocab_file = os.path.join(tmp, "vocab.json")
+        merges_file = os.path.join(tmp, "merges.txt")
+        with open(vocab_file, "w", encoding="utf-8") as f:
+            json.dump(vocab, f)
+        with open(merges_file, "w", encoding="utf-8") as f:
+            f.write("#version: 0.2\n")
+        return CLIPTokenizer(vocab_file, merges_file, model_max_length=MAX_TOKENS)
+
+
+def build_tiny_pipeline(dtype=torch.float32):
+    tokenizer = build_tokenizer()
+
+    torch.manual_seed(SEED)
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        vocab_size=len(tokenizer),
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+        **TEXT_CONFIG,
+    ))
+    unet = UNet2DConditionModel(**UNET_CONFIG)
+    vae = AutoencoderKL(**VAE_CONFIG)
+
+    pipe = StableDiffusionPipeline(
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tokenizer,
+        unet=unet,
+        scheduler=PNDMScheduler(**SCHEDULER_CONFIG),
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    )
+    return pipe.to(dtype=dtype)
+
+
+if __name__ == "__main__":
+    out_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tiny-sd")
+    build_tiny_pipeline().save_pretrained(out_dir)
+    print("Tiny pipeline saved to", out_dir)
@@ -5,6 +5,7 @@ import EncoderStation from './components/EncoderStation'
 import DiffusionViewer from './components/DiffusionViewer'
 import RefinementStation from './components/RefinementStation'
 import axios from 'axios'
+import { API_URL } from './config'
 import TrainingDemo from './components/TrainingDemo';   // ← already imported
 
 export default function App(){
@@ -12,14 +13,15 @@ export default function App(){
   const [prompt, setPrompt] = useState('')
   const [tokens, setTokens] = useState([])
   const [frames, setFrames] = useState([])
+  const [bundle, setBundle] = useState(null)
   const [step, setStep] = useState(0)
   const [loading, setLoading] = useState(false)
-  const [ts, setTs] = useState(Date.now())
   const [statusText, setStatusText] = useState('')
 
   async function generate(newPrompt){
     setPrompt(newPrompt)
     setFrames([])
+    setBundle(null)
     setStep(0)
     setStatusText('Tokenizing...')
     const toks = newPrompt.split(/(\s+)/).filter(t => t.trim().length > 0)
@@ -27,10 +29,27 @@ export default function App(){
     setLoading(true)
     setStatusText('Requesting image generation...')
     try {
-      const res = await axios.post('http://localhost:8000/generate', { prompt: newPrompt })
-      const frameFiles = res.data.frames || []
-      const prev = res.data.previous || null
-      setTs(Date.now())
+      const res = await axios.post(`${API_URL}/generate`, { prompt: newPrompt, bundle: 'sprite' })
+      let job = res.data
+
+      // Poll the job until the backend worker has finished it and packed its sprite sheet
+      while(job.status === 'queued' || job.status === 'running' || job.finishing){
+        setStatusText(job.status === 'queued'
+          ? `Waiting in queue (position ${(job.queue_position ?? 0) + 1})...`
+          : job.status === 'running'
+            ? `Denoising... ${job.frames.length} steps done`
+            : 'Packing frames...')
+        await new Promise(r => setTimeout(r, 500))
+        job = (await axios.get(`${API_URL}/jobs/${job.job_id}`)).data
+      }
+      if(job.status !== 'done'){
+        throw new Error(job.error || `job ${job.status}`)
+      }
+
+      const frameFiles = job.frames || []
+      const prev = job.previous || null
+      // one sprite sheet per generation instead of one request per frame
+      setBundle(job.bundle || null)
       setFrames(frameFiles)
       setPrevSelection(prev)
       setStatusText('Animating diffusion steps')
@@ -52,9 +71,8 @@ export default function App(){
     }
   }
 
-  // Compute final image URL to pass into TrainingDemo
-  const finalImageFile = frames.length ? frames[frames.length - 1] : null;
-  const finalImageUrl = finalImageFile ? `http://localhost:8000/static/${finalImageFile}` : null;
+  // Final image (backend frame path) for TrainingDemo's forward noising
+  const finalFrame = frames.length ? frames[frames.length - 1] : null;
 
   return (
     <div className="min-h-screen bg-gradient-to-br from-slate-900 via-slate-850 to-slate-900 text-slate-100 p-8">
@@ -75,9 +93,9 @@ export default function App(){
 
         {/* ⬇⬇⬇ INSERT TRAINING DEMO RIGHT HERE ⬇⬇⬇ */}
         <TrainingDemo
-          finalImageUrl={finalImageUrl}
+          finalFrame={finalFrame}
           backwardFrames={frames}
-          ts={ts}
+          bundle={bundle}
           initialSteps={20}
         />
         {/* ⬆⬆⬆ INSERT TRAINING DEMO RIGHT HERE ⬆⬆⬆ */}
@@ -87,8 +105,8 @@ export default function App(){
 
         {/* Diffusion + Refinement Section */}
         <div className="grid grid-cols-1 lg:grid-cols-2 gap-8">
-          <DiffusionViewer frames={frames} step={step} setStep={setStep} ts={ts} />
-          <RefinementStation frames={frames} step={step} ts={ts} prev={prevSelection} />
+          <DiffusionViewer frames={frames} step={step} setStep={setStep} bundle={bundle} />
+          <RefinementStation frames={frames} step={step} prev={prevSelection} bundle={bundle} />
         </div>
 
       </div>
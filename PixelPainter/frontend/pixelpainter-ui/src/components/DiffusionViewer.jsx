@@ -1,13 +1,12 @@
 // DiffusionViewer.jsx — Improved UI
 
 import { useEffect } from 'react'
+import FrameImage from './FrameImage'
 
-export default function DiffusionViewer({ frames = [], step = 0, setStep, ts=0 }) {
+export default function DiffusionViewer({ frames = [], step = 0, setStep, bundle = null }) {
 
   useEffect(()=>{ setStep(0) }, [frames])
 
-  const src = frames.length ? `http://localhost:8000/static/${frames[step]}?t=${ts}` : null
-
   return (
     <div className="bg-slate-800/70 p-5 rounded-2xl shadow-lg">
       <h3 className="text-xl font-semibold">🔄 Diffusion Steps</h3>
@@ -16,7 +15,9 @@ export default function DiffusionViewer({ frames = [], step = 0, setStep, ts=0 }
       <div className="mt-4 flex flex-col items-center">
 
         <div className="w-[384px] h-[384px] bg-black rounded-xl border border-slate-700 overflow-hidden flex items-center justify-center">
-          {src ? <img src={src} alt="frame" className="object-cover w-full h-full" /> : <div className="text-slate-500">No frames</div>}
+          {frames.length
+            ? <FrameImage src={frames[step]} index={step} bundle={bundle} alt="frame" className="object-cover w-full h-full" />
+            : <div className="text-slate-500">No frames</div>}
         </div>
 
         <div className="mt-4 flex items-center gap-3">
@@ -0,0 +1,36 @@
+// File: src/components/FrameImage.jsx
+import { API_URL } from '../config'
+
+/*
+FrameImage
+Shows one diffusion frame. When the job came with a sprite-sheet bundle the
+frame is a cell of that single image (one download per generation); otherwise
+the frame's own URL is used.
+Props:
+- src: frame path from the backend e.g. "frames/<hash>.webp"
+- index: step index of the frame inside the bundle
+- bundle: job.bundle from the backend (sprite index + url), or null
+*/
+export default function FrameImage({ src = null, index = 0, bundle = null, alt = 'frame', className = '' }){
+
+  if(bundle && bundle.kind === 'sprite' && index < bundle.frames.length){
+    const col = index % bundle.columns
+    const row = Math.floor(index / bundle.columns)
+    // percentage positions scale with the box, whatever size it is rendered at
+    const pos = (i, n) => n > 1 ? `${(i / (n - 1)) * 100}%` : '0%'
+    return (
+      <div
+        role="img"
+        aria-label={alt}
+        className={className}
+        style={{
+          backgroundImage: `url(${API_URL}/${bundle.url})`,
+          backgroundSize: `${bundle.columns * 100}% ${bundle.rows * 100}%`,
+          backgroundPosition: `${pos(col, bundle.columns)} ${pos(row, bundle.rows)}`,
+        }}
+      />
+    )
+  }
+
+  return src ? <img src={`${API_URL}/${src}`} alt={alt} className={className} /> : null
+}
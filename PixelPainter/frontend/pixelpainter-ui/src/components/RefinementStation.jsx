@@ -1,21 +1,24 @@
-export default function RefinementStation({ frames = [], step = 0, ts = 0, prev = null }) {
+import FrameImage from './FrameImage'
 
-  const makeUrl = (rel) => rel ? `http://localhost:8000/static/${rel}?t=${ts}` : null
+export default function RefinementStation({ frames = [], step = 0, prev = null, bundle = null }) {
 
-  // Current run selection
+  // Current run selection (indices into frames / the sprite bundle)
+  const midIdx = Math.floor(frames.length / 2)
+  const lastIdx = frames.length - 1
   const currStart = frames.length ? frames[0] : null
-  const currMiddle = frames.length ? frames[Math.floor(frames.length / 2)] : null
-  const currFinal = frames.length ? frames[frames.length - 1] : null
+  const currMiddle = frames.length ? frames[midIdx] : null
+  const currFinal = frames.length ? frames[lastIdx] : null
 
   const prevStart = prev ? prev.start : null
   const prevMiddle = prev ? prev.middle : null
   const prevFinal = prev ? prev.final : null
 
-  const imgCard = (src, label) => (
+  // previous-run frames are plain references; only the current run has a bundle
+  const imgCard = (src, label, index = 0, cardBundle = null) => (
     <div className="text-center">
       <div className="text-sm text-slate-300 mb-2">{label}</div>
       <div className="w-40 h-40 bg-black rounded-xl border border-slate-700 overflow-hidden flex items-center justify-center mx-auto">
-        {src ? <img src={src} className="object-cover w-full h-full" alt={label} /> : <div className="text-slate-500 p-6">—</div>}
+        {src ? <FrameImage src={src} index={index} bundle={cardBundle} className="object-cover w-full h-full" alt={label} /> : <div className="text-slate-500 p-6">—</div>}
       </div>
     </div>
   )
@@ -30,9 +33,9 @@ export default function RefinementStation({ frames = [], step = 0, ts = 0, prev
         <div>
           <div className="text-sm text-slate-300 mb-3">Previous Generation</div>
           <div className="flex gap-4 items-start">
-            {imgCard(makeUrl(prevStart), 'Start')}
-            {imgCard(makeUrl(prevMiddle), 'Middle')}
-            {imgCard(makeUrl(prevFinal), 'Final')}
+            {imgCard(prevStart, 'Start')}
+            {imgCard(prevMiddle, 'Middle')}
+            {imgCard(prevFinal, 'Final')}
           </div>
         </div>
 
@@ -40,9 +43,9 @@ export default function RefinementStation({ frames = [], step = 0, ts = 0, prev
         <div>
           <div className="text-sm text-slate-300 mb-3">Current Generation</div>
           <div className="flex gap-4 items-start">
-            {imgCard(makeUrl(currStart), 'Start')}
-            {imgCard(makeUrl(currMiddle), 'Middle')}
-            {imgCard(makeUrl(currFinal), 'Final')}
+            {imgCard(currStart, 'Start', 0, bundle)}
+            {imgCard(currMiddle, 'Middle', midIdx, bundle)}
+            {imgCard(currFinal, 'Final', lastIdx, bundle)}
           </div>
         </div>
       </div>
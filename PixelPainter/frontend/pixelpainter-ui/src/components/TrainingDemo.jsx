@@ -1,21 +1,24 @@
 // File: src/components/TrainingDemo.jsx
-import { useEffect, useMemo, useRef, useState } from "react";
+import { useEffect, useRef, useState } from "react";
+import axios from "axios";
+import { API_URL } from "../config";
+import FrameImage from "./FrameImage";
 
 /*
 TrainingDemo
 Props:
-- finalImageUrl: URL of the clean target image (string). If null, forward side shows placeholder.
-- backwardFrames: array of backend frame filenames e.g. ["step_000.png", ...]
-- ts: timestamp for cache-busting used in other components
+- finalFrame: backend path of the clean target image e.g. "frames/<hash>.webp". If null, forward side shows placeholder.
+- backwardFrames: array of backend frame paths e.g. ["frames/<hash>.webp", ...]
+- bundle: sprite-sheet bundle of backwardFrames from the backend (optional)
 - initialSteps: number of frames to create for forward sim (default 20)
 */
 export default function TrainingDemo({
-  finalImageUrl = null,
+  finalFrame = null,
   backwardFrames = [],
-  ts = 0,
+  bundle = null,
   initialSteps = 20,
 }) {
-  const [forwardFrames, setForwardFrames] = useState([]); // dataURLs
+  const [forwardBundle, setForwardBundle] = useState(null); // sprite index from /forward
   const [steps, setSteps] = useState(initialSteps);
   const [speedMs, setSpeedMs] = useState(200);
   const [playing, setPlaying] = useState(false);
@@ -24,93 +27,29 @@ export default function TrainingDemo({
 
   const playRef = useRef(null);
 
-  // Utility: load image as HTMLImageElement (promise)
-  const loadImage = (src) =>
-    new Promise((resolve, reject) => {
-      const img = new Image();
-      img.crossOrigin = "anonymous";
-      img.onload = () => resolve(img);
-      img.onerror = (e) => reject(e);
-      img.src = src;
-    });
-
-  // Generate simulated forward frames (client-side)
+  // Forward frames: the backend noises the final image with the model's real
+  // scheduler (VAE encode once, all timesteps in one batch) and returns one sprite sheet
   useEffect(() => {
     let cancelled = false;
 
     async function gen() {
-      if (!finalImageUrl) {
-        setForwardFrames([]);
+      if (!finalFrame) {
+        setForwardBundle(null);
         return;
       }
 
       try {
-        const img = await loadImage(finalImageUrl + (finalImageUrl.includes("?") ? "&" : "?") + `t=${ts}`);
-        // create a canvas matching displayed size (we use 384x384 to match your viewer)
-        const W = 384;
-        const H = 384;
-        const canvas = document.createElement("canvas");
-        canvas.width = W;
-        canvas.height = H;
-        const ctx = canvas.getContext("2d");
-
-        // Draw base image sized to fit (cover)
-        ctx.fillStyle = "black";
-        ctx.fillRect(0, 0, W, H);
-        // Draw image centered & cover-like
-        const imgRatio = img.width / img.height;
-        const targetRatio = W / H;
-        let drawW = W, drawH = H, offsetX = 0, offsetY = 0;
-        if (imgRatio > targetRatio) {
-          // image wider
-          drawH = H;
-          drawW = Math.round(H * imgRatio);
-          offsetX = Math.round((W - drawW) / 2);
-        } else {
-          drawW = W;
-          drawH = Math.round(W / imgRatio);
-          offsetY = Math.round((H - drawH) / 2);
-        }
-
-        // Get original imageData for pixel values
-        ctx.drawImage(img, offsetX, offsetY, drawW, drawH);
-        const baseImageData = ctx.getImageData(0, 0, W, H);
-
-        // For reproducible-ish noise across frames we will use Math.random() (no seed)
-        const frames = [];
-        for (let i = 0; i < steps; ++i) {
-          if (cancelled) return;
-          const alpha = (i + 1) / steps; // 0<alpha<=1: fraction of noise
-          // create new ImageData
-          const newData = ctx.createImageData(W, H);
-          for (let p = 0; p < baseImageData.data.length; p += 4) {
-            // base pixel
-            const r = baseImageData.data[p];
-            const g = baseImageData.data[p + 1];
-            const b = baseImageData.data[p + 2];
-            const aPixel = baseImageData.data[p + 3];
-
-            // noise pixel ~ gaussian approx with two uniform draws (quick)
-            // scale noise to full [0,255]
-            const nr = Math.floor((Math.random() + Math.random()) * 127.5); // rough bell-shape
-            const ng = Math.floor((Math.random() + Math.random()) * 127.5);
-            const nb = Math.floor((Math.random() + Math.random()) * 127.5);
-
-            // blend: (1 - alpha)*orig + alpha*noise
-            newData.data[p] = Math.max(0, Math.min(255, Math.round((1 - alpha) * r + alpha * nr)));
-            newData.data[p + 1] = Math.max(0, Math.min(255, Math.round((1 - alpha) * g + alpha * ng)));
-            newData.data[p + 2] = Math.max(0, Math.min(255, Math.round((1 - alpha) * b + alpha * nb)));
-            newData.data[p + 3] = aPixel;
-          }
-          // put it and export dataURL
-          ctx.putImageData(newData, 0, 0);
-          frames.push(canvas.toDataURL("image/png"));
+        const res = await axios.post(`${API_URL}/forward`, {
+          frame: finalFrame,
+          frames: steps,
+        });
+        if (!cancelled) {
+          setForwardBundle(res.data);
+          setFIndex((i) => Math.min(i, res.data.frames.length - 1));
         }
-
-        if (!cancelled) setForwardFrames(frames);
       } catch (e) {
         console.error("Forward frame generation failed", e);
-        setForwardFrames([]);
+        if (!cancelled) setForwardBundle(null);
       }
     }
 
@@ -118,7 +57,9 @@ export default function TrainingDemo({
     return () => {
       cancelled = true;
     };
-  }, [finalImageUrl, ts, steps]);
+  }, [finalFrame, steps]);
+
+  const forwardCount = forwardBundle ? forwardBundle.frames.length : 0;
 
   // Playback handler
   useEffect(() => {
@@ -132,7 +73,7 @@ export default function TrainingDemo({
     // Start a timer to advance both animations
     playRef.current = setInterval(() => {
       setFIndex((prev) => {
-        const next = (prev + 1) % Math.max(1, forwardFrames.length || 1);
+        const next = (prev + 1) % Math.max(1, forwardCount || 1);
         return next;
       });
       setBIndex((prev) => {
@@ -146,14 +87,12 @@ export default function TrainingDemo({
         playRef.current = null;
       }
     };
-  }, [playing, speedMs, forwardFrames.length, backwardFrames.length]);
+  }, [playing, speedMs, forwardCount, backwardFrames.length]);
 
   // clickable scrubbing for forward/backward
-  const forwardSrc = forwardFrames.length ? forwardFrames[fIndex] : null;
-  const backwardSrc =
-    backwardFrames.length > 0
-      ? `http://localhost:8000/static/${backwardFrames[Math.max(0, Math.min(backwardFrames.length - 1, bIndex))]}?t=${ts}`
-      : null;
+  const forwardIdx = Math.max(0, Math.min(forwardCount - 1, fIndex));
+  const backwardIdx = Math.max(0, Math.min(backwardFrames.length - 1, bIndex));
+  const backwardSrc = backwardFrames.length > 0 ? backwardFrames[backwardIdx] : null;
 
   // Basic UI
   return (
@@ -185,8 +124,8 @@ export default function TrainingDemo({
         <div className="p-3 bg-slate-900 rounded-lg">
           <div className="text-sm text-slate-400 mb-2">Forward diffusion (training): clean → noise</div>
           <div className="w-[320px] h-[320px] bg-black rounded-lg overflow-hidden mx-auto border border-slate-700 flex items-center justify-center">
-            {forwardSrc ? (
-              <img src={forwardSrc} alt="forward" className="object-cover w-full h-full" />
+            {forwardBundle ? (
+              <FrameImage index={forwardIdx} bundle={forwardBundle} alt="forward" className="object-cover w-full h-full" />
             ) : (
               <div className="text-slate-500 p-6 text-center">No final image available</div>
             )}
@@ -197,12 +136,12 @@ export default function TrainingDemo({
             <input
               type="range"
               min={0}
-              max={Math.max(0, steps - 1)}
-              value={fIndex}
+              max={Math.max(0, forwardCount - 1)}
+              value={forwardIdx}
               onChange={(e) => { setFIndex(parseInt(e.target.value)); setPlaying(false); }}
               className="w-48"
             />
-            <div className="text-xs text-slate-300">{fIndex + 1} / {Math.max(1, steps)}</div>
+            <div className="text-xs text-slate-300">{forwardIdx + 1} / {Math.max(1, forwardCount)}</div>
           </div>
 
           <div className="mt-2 flex items-center justify-between text-xs text-slate-400">
@@ -216,7 +155,9 @@ export default function TrainingDemo({
                 className="ml-2 w-16 bg-slate-800 px-2 py-0.5 rounded text-xs"
               />
             </div>
-            <div className="italic">Simulated client-side (fast)</div>
+            <div className="italic">
+              {forwardBundle ? `Real noise schedule (t = ${forwardBundle.timesteps[forwardIdx]})` : "Real noise schedule (backend)"}
+            </div>
           </div>
         </div>
 
@@ -225,7 +166,7 @@ export default function TrainingDemo({
           <div className="text-sm text-slate-400 mb-2">Backward diffusion (generation): noise → clean</div>
           <div className="w-[320px] h-[320px] bg-black rounded-lg overflow-hidden mx-auto border border-slate-700 flex items-center justify-center">
             {backwardSrc ? (
-              <img src={backwardSrc} alt="backward" className="object-cover w-full h-full" />
+              <FrameImage src={backwardSrc} index={backwardIdx} bundle={bundle} alt="backward" className="object-cover w-full h-full" />
             ) : (
               <div className="text-slate-500 p-6 text-center">No generated frames yet</div>
             )}
@@ -0,0 +1,4 @@
+// File: src/config.js
+// Backend base URL. Behind the shared exhibit host (host/serve.py) run e.g.
+//   VITE_API_URL=http://localhost:8000/pixelpainter npm run dev
+export const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000'
@@ -1,5 +1,9 @@
 # wordweaver-backend/llm_core.py
+import gc
 import math
+import os
+import threading
+from contextlib import contextmanager
 import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
 
@@ -9,22 +13,123 @@ tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, use_fast=False)
 
 bnb = BitsAndBytesConfig(load_in_8bit=True)
 
-model = AutoModelForCausalLM.from_pretrained(
-    MODEL_NAME,
-    quantization_config=bnb,
-    device_map="auto",
-    trust_remote_code=True,
-    attn_implementation="eager"
-)
+# ---- long-context guardrails ----
+# prompts longer than this are cut from the left (oldest tokens dropped)
+# before they reach the model, on every endpoint
+MAX_CONTEXT_TOKENS = int(os.environ.get("WORDWEAVER_MAX_TOKENS", "2048"))
+# attention / hidden states are only captured for this many trailing tokens
+MAX_WINDOW_TOKENS = int(os.environ.get("WORDWEAVER_MAX_WINDOW_TOKENS", "64"))
+
+# loaded on first use (main.py warms it up at startup), dropped by unload_model()
+model = None
+_model_lock = threading.Lock()
+
+
+def load_model():
+    """Load the 8-bit model once; returns the shared instance."""
+    global model
+    with _model_lock:
+        if model is None:
+            model = AutoModelForCausalLM.from_pretrained(
+                MODEL_NAME,
+                quantization_config=bnb,
+                device_map="auto",
+                trust_remote_code=True,
+                attn_implementation="eager"
+            )
+        return model
+
+
+def unload_model():
+    """
+    Free the model's GPU memory. bitsandbytes 8-bit weights cannot be moved
+    with .to("cpu"), so the model is dropped and load_model() reads it back
+    from the local Hugging Face cache on next use.
+    """
+    global model
+    with _model_lock:
+        model = None
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+# internal_forward switches the shared model's attention implementation
+# between its two passes, so every forward on the model takes this lock
+_forward_lock = threading.Lock()
+
+
+@contextmanager
+def _attn_implementation(model, name):
+    # attention layers and the mask builder read config._attn_implementation
+    # on every call from transformers 4.48 on (pinned in requirements.txt)
+    previous = model.config._attn_implementation
+    model.config._attn_implementation = name
+    try:
+        yield
+    finally:
+        model.config._attn_implementation = previous
+
+
+def _windowed_forward(model, input_ids, start_idx):
+    """
+    Forward pass whose memory is bounded by the inspected window, not the prompt.
+
+    The prefix (tokens before start_idx) runs through the base model (no
+    lm_head, so no [seq_len, vocab] logits) with memory-efficient SDPA
+    attention and only fills the KV cache. The window (last tokens) then
+    runs on top of that cache with eager attention, so output_attentions
+    holds [heads, n, seq_len] per layer instead of [heads, seq_len, seq_len],
+    and hidden states and logits cover the window only.
+    """
+    past = None
+    if start_idx > 0:
+        with _attn_implementation(model, "sdpa"):
+            past = model.get_decoder()(input_ids[:, :start_idx], use_cache=True).past_key_values
+
+    with _attn_implementation(model, "eager"):
+        try:
+            return model(
+                input_ids[:, start_idx:],
+                past_key_values=past,
+                use_cache=past is not None,
+                output_attentions=True,
+                output_hidden_states=True,
+            )
+        except TypeError:
+            # some wrappers require flags in config instead; try without flags
+            return model(input_ids[:, start_idx:], past_key_values=past)
+
+
+def _memory_estimate(model, seq_len, n):
+    """Bytes this request pins: the KV cache and the window's attentions, hidden states and logits."""
+    config = model.config
+    layers = config.num_hidden_layers
+    heads = config.num_attention_heads
+    kv_heads = getattr(config, "num_key_value_heads", None) or heads
+    head_dim = getattr(config, "head_dim", None) or config.hidden_size // heads
+    elem = torch.finfo(model.dtype).bits // 8
+    return {
+        # the window pass appends its own keys / values to the prefix cache
+        # (no cache at all when the window is the whole context)
+        "kv_cache_bytes": 2 * layers * kv_heads * seq_len * head_dim * elem if seq_len > n else 0,
+        "attention_bytes": layers * heads * n * seq_len * elem,
+        "hidden_states_bytes": (layers + 1) * n * config.hidden_size * elem,
+        "logits_bytes": n * config.vocab_size * elem,
+    }
 
 # ---- existing next-token function ----
 def compute_next_token(context_text, temp=1.0, top_k=10):
+    model = load_model()
     device = next(model.parameters()).device
 
     inputs = tokenizer(context_text, return_tensors="pt", add_special_tokens=False)
-    input_ids = inputs["input_ids"].to(device)
+    original_len = inputs["input_ids"].shape[1]
+    # same left truncation as internal_forward; the UI resends the whole
+    # context for every token
+    input_ids = inputs["input_ids"][:, -MAX_CONTEXT_TOKENS:].to(device)
 
-    with torch.no_grad():
+    with _forward_lock, torch.no_grad():
         outputs = model(input_ids)
         logits = outputs.logits[0, -1] / max(temp, 1e-8)
         probs = torch.softmax(logits, dim=-1)
@@ -39,20 +144,25 @@ def compute_next_token(context_text, temp=1.0, top_k=10):
         next_id = torch.multinomial(probs, 1).item()
         next_token = tokenizer.decode([next_id])
 
-    # Return full IDs so TokenTable shows accurate Token IDs
+    # Return the IDs the model saw so TokenTable shows accurate Token IDs
     return {
         "next_token": next_token,
         "candidates": tokens,
         "probs": vals,
-        "token_ids": input_ids[0].cpu().tolist()
+        "token_ids": input_ids[0].cpu().tolist(),
+        "truncated": original_len > input_ids.shape[1],
+        "original_tokens": original_len,
+        "context_tokens": input_ids.shape[1],
     }
 
 # ---- existing get_embeddings (unchanged) ----
 def get_embeddings(context_text: str, num_tokens: int = 3):
+    model = load_model()
     device = next(model.parameters()).device
 
     inputs = tokenizer(context_text, return_tensors="pt", add_special_tokens=False)
-    input_ids = inputs["input_ids"].to(device)  # shape (1, seq_len)
+    # at most the last MAX_CONTEXT_TOKENS tokens, like the other endpoints
+    input_ids = inputs["input_ids"][:, -MAX_CONTEXT_TOKENS:].to(device)  # shape (1, seq_len)
 
     seq = input_ids[0]
     seq_len = seq.shape[0]
@@ -62,7 +172,7 @@ def get_embeddings(context_text: str, num_tokens: int = 3):
     n = max(1, min(num_tokens, seq_len))
     selected_ids = seq[-n:]  # a tensor of length n
 
-    with torch.no_grad():
+    with _forward_lock, torch.no_grad():
         embed_layer = model.get_input_embeddings()
         selected_ids = selected_ids.unsqueeze(0)
         embeddings = embed_layer(selected_ids)
@@ -80,41 +190,64 @@ def get_embeddings(context_text: str, num_tokens: int = 3):
     return result
 
 # ---- NEW: internal_forward to expose intermediate values ----
-def internal_forward(context_text: str, num_tokens: int = 3, layer_index: int = -1):
+def internal_forward(context_text: str, num_tokens: int = 3, layer_index: int = -1, max_tokens: int = None):
     """
-    Perform a forward pass and return internals:
+    Perform a forward pass and return internals for the last `num_tokens`
+    tokens (at most MAX_WINDOW_TOKENS):
       - selected token embeddings
       - a positional vector (sinusoidal demo)
       - averaged attention matrix (last or chosen layer)
       - Q/K/V projections for selected tokens (if accessible)
       - FFN/hidden state for last layer (if available)
       - logits (raw) for the last position
+    Contexts longer than `max_tokens` (capped by MAX_CONTEXT_TOKENS) keep
+    only their last tokens and report "truncated": true. "memory" holds
+    this request's memory accounting.
     """
 
+    model = load_model()
     device = next(model.parameters()).device
 
     # Tokenize and prepare
     inputs = tokenizer(context_text, return_tensors="pt", add_special_tokens=False)
-    input_ids = inputs["input_ids"].to(device)
-    seq_len = input_ids.shape[1] if input_ids is not None else 0
+    input_ids = inputs["input_ids"]
+    original_len = input_ids.shape[1] if input_ids is not None else 0
 
-    if seq_len == 0:
+    if original_len == 0:
         return {"error": "no tokens in input"}
 
+    # cap the context (left truncation keeps the tokens nearest the prediction)
+    limit = MAX_CONTEXT_TOKENS if max_tokens is None else max(1, min(max_tokens, MAX_CONTEXT_TOKENS))
+    input_ids = input_ids[:, -limit:].to(device)
+    seq_len = input_ids.shape[1]
+
     # number of tokens to inspect: last `num_tokens`
-    n = max(1, min(num_tokens, seq_len))
+    n = max(1, min(num_tokens, seq_len, MAX_WINDOW_TOKENS))
     start_idx = seq_len - n
     positions = list(range(start_idx, seq_len))
 
-    # Do a forward pass asking model to return attentions and hidden_states
-    with torch.no_grad():
-        try:
-            outputs = model(input_ids, output_attentions=True, output_hidden_states=True)
-        except TypeError:
-            # some wrappers require flags in config instead; try without flags
-            outputs = model(input_ids)
-
-    resp = {}
+    # Prefix with SDPA + KV cache, window with eager attention (see _windowed_forward)
+    with _forward_lock, torch.no_grad():
+        on_cuda = device.type == "cuda"
+        if on_cuda:
+            torch.cuda.reset_peak_memory_stats(device)
+            allocated_before = torch.cuda.memory_allocated(device)
+        outputs = _windowed_forward(model, input_ids, start_idx)
+        memory = {
+            "context_tokens": seq_len,
+            "window_tokens": n,
+            **_memory_estimate(model, seq_len, n),
+        }
+        if on_cuda:
+            memory["peak_cuda_bytes"] = torch.cuda.max_memory_allocated(device) - allocated_before
+
+    resp = {
+        "truncated": original_len > seq_len,
+        "original_tokens": original_len,
+        "context_tokens": seq_len,
+        "window_tokens": n,
+        "memory": memory,
+    }
     # ---- logits (raw scores) for last position ----
     try:
         logits = outputs.logits  # shape [1, seq_len, vocab_size]
@@ -129,27 +262,22 @@ def internal_forward(context_text: str, num_tokens: int = 3, layer_index: int =
         hidden_states = outputs.hidden_states
         # choose the layer index (negative indexes allowed)
         chosen_hidden = hidden_states[layer_index]  # shape [1, seq_len, dim]
-        # move to CPU and convert last n token hidden states to list
-        chosen_hidden_cpu = chosen_hidden[0, start_idx:seq_len].cpu().tolist()
+        # the window pass only returns hidden states for the last n tokens
+        chosen_hidden_cpu = chosen_hidden[0].cpu().tolist()
         resp["hidden_states_selected"] = chosen_hidden_cpu
     except Exception:
         resp["hidden_states_selected"] = None
 
     # ---- attentions ----
     try:
-        # attentions: tuple of (layer) tensors [batch, num_heads, seq_len, seq_len]
+        # attentions: tuple of (layer) tensors [batch, num_heads, n, seq_len]
+        # (window query rows against every key, prefix included)
         attentions = outputs.attentions
         # pick requested layer (last by default)
-        att = attentions[layer_index]  # shape [batch, num_heads, seq_len, seq_len]
-        # average heads to get single matrix [seq_len, seq_len]
-        att_avg = att[0].mean(dim=0).cpu().tolist()
-        # For compactness, only return the last n x n submatrix (selected tokens attending to selected tokens)
-        att_sub = [[row[start_idx:seq_len] for row in att_avg][r][c] for r in range(start_idx, seq_len) for c in range(start_idx, seq_len)]
-        # better shape: create proper submatrix
-        att_matrix = []
-        for r in range(start_idx, seq_len):
-            row_vals = att_avg[r][start_idx:seq_len]
-            att_matrix.append([float(v) for v in row_vals])
+        att = attentions[layer_index]
+        # average heads, keep selected tokens attending to selected tokens: n x n
+        att_sub = att[0].mean(dim=0)[:, start_idx:seq_len]
+        att_matrix = [[float(v) for v in row] for row in att_sub.cpu().tolist()]
         resp["attention_matrix_selected"] = att_matrix  # n x n
     except Exception:
         resp["attention_matrix_selected"] = None
@@ -219,7 +347,7 @@ def internal_forward(context_text: str, num_tokens: int = 3, layer_index: int =
                 # use chosen_hidden (the input to that layer) if present, else use embeddings
                 src_hidden = None
                 try:
-                    src_hidden = hidden_states[layer_index][0, start_idx:seq_len]  # shape [n, dim]
+                    src_hidden = hidden_states[layer_index][0]  # shape [n, dim]
                 except Exception:
                     src_hidden = None
                 if src_hidden is None:
@@ -1,8 +1,9 @@
 # wordweaver-backend/main.py
+from typing import Optional
 from fastapi import FastAPI
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-from llm_core import compute_next_token, get_embeddings, internal_forward
+from llm_core import compute_next_token, get_embeddings, internal_forward, load_model
 
 app = FastAPI()
 
@@ -29,6 +30,7 @@ class InternalRequest(BaseModel):
     context: str
     num_tokens: int = 3
     layer_index: int = -1
+    max_tokens: Optional[int] = None   # context cap; server cap applies if larger
 
 @app.post("/generate")
 def generate(req: GenRequest):
@@ -55,10 +57,23 @@ def internal(req: InternalRequest):
       attention_matrix_selected (n x n)
       hidden_states_selected (n x dim)
       logits (raw for last position)
+    Long contexts are left-truncated to max_tokens ("truncated": true) and
+    internals cover at most the last MAX_WINDOW_TOKENS tokens; "memory"
+    reports what the request used.
     """
-    data = internal_forward(req.context, num_tokens=req.num_tokens, layer_index=req.layer_index)
+    data = internal_forward(
+        req.context,
+        num_tokens=req.num_tokens,
+        layer_index=req.layer_index,
+        max_tokens=req.max_tokens
+    )
     return data
 
+@app.on_event("startup")
+def warm_up():
+    # load the model before the first visitor instead of on their request
+    load_model()
+
 @app.get("/")
 def root():
     return {"status": "WordWeaver FastAPI backend running"}
@@ -2,6 +2,7 @@
 
 import React, { useState, useEffect } from "react";
 import axios from "axios";
+import { API_URL } from "../config";
 import Embedding3DViewer from "./Embedding3DViewer";
 
 function shortVals(arr, n = 24) {
@@ -48,7 +49,7 @@ export default function InternalInspector({
     setLoading(true);
     try {
       const res = await axios.post(
-        "http://localhost:8000/internal_forward",
+        `${API_URL}/internal_forward`,
         { context, num_tokens: numTokens, layer_index: -1 },
         { timeout: 150000 }
       );
@@ -99,6 +100,14 @@ export default function InternalInspector({
           subtitle="The complete list of tokens produced so far."
         />
 
+        {/* long prompts: the backend inspects only the last tokens */}
+        {(data.truncated || data.window_tokens < data.context_tokens) && (
+          <div className="mb-2 text-xs text-amber-300">
+            Showing the last {data.window_tokens} of {data.original_tokens} tokens
+            {data.truncated ? ` (context cut to the last ${data.context_tokens})` : ""}.
+          </div>
+        )}
+
         <div className="flex flex-wrap gap-2">
           {(data.tokens_selected || []).map((t, i) => (
             <div
@@ -1,6 +1,7 @@
 // src/components/PromptBox.jsx
 import React, { useState } from "react";
 import axios from "axios";
+import { API_URL } from "../config";
 
 const presets = [
   "Once upon a time",
@@ -28,6 +29,7 @@ export default function PromptBox({
 }) {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState("");
+  const [truncatedNote, setTruncatedNote] = useState("");
 
   const generateNext = async () => {
     setError("");
@@ -39,7 +41,7 @@ export default function PromptBox({
 
     setLoading(true);
     try {
-      const res = await axios.post("http://localhost:8000/generate", {
+      const res = await axios.post(`${API_URL}/generate`, {
         context: ctx,
         temperature: temperature,
         top_k: topK
@@ -49,6 +51,9 @@ export default function PromptBox({
       const nextToken = data.next_token ?? "";
       const cands = data.candidates ?? [];
       const probs = data.probs ?? [];
+      setTruncatedNote(data.truncated
+        ? `Long prompt: the model only saw the last ${data.context_tokens} of ${data.original_tokens} tokens.`
+        : "");
 
       // spacing heuristics like streamlit
       let newOutput = output && output.length ? output : context;
@@ -105,6 +110,7 @@ export default function PromptBox({
     setProbs([]);
     setTokenIds([]);
     setError("");
+    setTruncatedNote("");
 
     // reset inspector too (optional): trigger a refresh so it clears
     if (typeof setAutoRefreshTrigger === "function") {
@@ -154,6 +160,7 @@ export default function PromptBox({
       </div>
 
       {error && <div className="mt-2 text-sm text-rose-300">{error}</div>}
+      {truncatedNote && <div className="mt-2 text-xs text-amber-300">{truncatedNote}</div>}
     </div>
   );
 }
@@ -0,0 +1,257 @@
+import gc
+import threading
+import time
+from contextlib import contextmanager
+import torch
+from starlette.concurrency import run_in_threadpool
+
+# model states
+UNLOADED = "unloaded"     # not in memory; load() reads it from disk
+OFFLOADED = "offloaded"   # weights parked in CPU RAM; restore() moves them back
+LOADING = "loading"
+RESIDENT = "resident"     # on the device, ready to serve
+EVICTING = "evicting"
+
+
+def module_memory_mb(*modules):
+    """Bytes of parameters + buffers of torch modules, in MB."""
+    total = 0
+    for module in modules:
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            total += tensor.numel() * tensor.element_size()
+    return total / 2 ** 20
+
+
+class Model:
+    """
+    One model the host can page in and out.
+
+    load():    bring the model onto the device from scratch.
+    unload():  drop it completely (it is loaded from disk next time).
+    offload(): optional; park the weights in CPU RAM (cheaper to restore).
+    restore(): required with offload(); move them back onto the device.
+    size_mb:   device memory it needs while resident. measure(), if given,
+               replaces the estimate with the real footprint after loading.
+    """
+
+    def __init__(self, name, load, unload=None, offload=None, restore=None, size_mb=0, measure=None):
+        if unload is None and offload is None:
+            raise ValueError(f"model {name!r} needs unload() or offload()")
+        self.name = name
+        self.load = load
+        self.unload = unload
+        self.offload = offload
+        self.restore = restore
+        self.size_mb = size_mb
+        self.measure = measure
+
+        self.state = UNLOADED
+        self.users = 0
+        self.waiting = 0          # callers blocked until memory frees up
+        self.last_used = 0.0
+
+    def to_dict(self, now):
+        return {
+            "state": self.state,
+            "size_mb": round(self.size_mb, 1),
+            "users": self.users,
+            "waiting": self.waiting,
+            "idle_seconds": round(now - self.last_used, 1) if self.last_used else None,
+        }
+
+
+class ResidencyManager:
+    """
+    Keeps the models of several apps within one device-memory budget.
+
+    Callers wrap every use of a model in `with manager.use(name):`. If the
+    model is not resident it is restored / loaded first, and idle resident
+    models are evicted least-recently-used first until it fits: offloaded
+    to CPU when they support it, otherwise unloaded. A model is never
+    evicted while a caller is using it; if the budget cannot be met until
+    one finishes, use() waits; while it does, other models admit no new
+    users, so their current users drain and memory is freed.
+    """
+
+    def __init__(self, budget_mb):
+        self.budget_mb = budget_mb
+        self._models = {}
+        self._cond = threading.Condition()
+
+    def register(self, name, **kwargs):
+        with self._cond:
+            self._models[name] = Model(name, **kwargs)
+
+    # ---- acquire / release ----
+    @contextmanager
+    def use(self, name):
+        self.acquire(name)
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    def acquire(self, name):
+        with self._cond:
+            model = self._models[name]
+            while True:
+                if model.state == RESIDENT and not self._starving(model):
+                    model.users += 1
+                    model.last_used = time.time()
+                    return
+                if model.state in (UNLOADED, OFFLOADED):
+                    victims = self._make_room(model)
+                    if victims is not None:
+                        break
+                    # memory is in use by other models; make them drain
+                    model.waiting += 1
+                    try:
+                        self._cond.wait()
+                    finally:
+                        model.waiting -= 1
+                    continue
+                # someone else is loading / evicting it, or another model waits
+                self._cond.wait()
+
+            previous = model.state
+            model.state = LOADING
+            for victim in victims:
+                victim.state = EVICTING
+
+        try:
+            for victim in victims:
+                self._evict(victim)
+            if previous == OFFLOADED:
+                model.restore()
+            else:
+                model.load()
+            if model.measure is not None:
+                model.size_mb = model.measure()
+        except BaseException:
+            with self._cond:
+                model.state = previous
+                self._cond.notify_all()
+            raise
+
+        with self._cond:
+            model.state = RESIDENT
+            model.users += 1
+            model.last_used = time.time()
+            self._cond.notify_all()
+
+    def release(self, name):
+        with self._cond:
+            model = self._models[name]
+            model.users -= 1
+            model.last_used = time.time()
+            self._cond.notify_all()
+
+    # ---- eviction ----
+    def _starving(self, model):
+        """True if another model is waiting for memory that `model` holds."""
+        return any(m.waiting for m in self._models.values() if m is not model)
+
+    def _used_mb(self):
+        return sum(m.size_mb for m in self._models.values() if m.state in (RESIDENT, LOADING, EVICTING))
+
+    def _make_room(self, model):
+        """
+        Idle models to evict (LRU first) so `model` fits the budget, or None
+        if it has to wait for models that are busy. Called with the lock held.
+        """
+        used = self._used_mb()
+        if used + model.size_mb <= self.budget_mb:
+            return []
+        idle = sorted(
+            (m for m in self._models.values() if m.state == RESIDENT and m.users == 0),
+            key=lambda m: m.last_used,
+        )
+        victims = []
+        for victim in idle:
+            victims.append(victim)
+            used -= victim.size_mb
+            if used + model.size_mb <= self.budget_mb:
+                return victims
+
+        busy = any(m.state in (LOADING, EVICTING) or m.users > 0
+                   for m in self._models.values() if m is not model)
+        if busy:
+            return None
+        # bigger than the budget on its own: free everything and try anyway
+        print(f"Warning: model {model.name!r} ({model.size_mb:.0f} MB) exceeds the "
+              f"{self.budget_mb} MB budget")
+        return victims
+
+    def _evict(self, model):
+        try:
+            if model.offload is not None:
+                model.offload()
+                state = OFFLOADED
+            else:
+                model.unload()
+                state = UNLOADED
+        except Exception as e:
+            print(f"Warning: evicting {model.name!r} failed:", e)
+            state = RESIDENT
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        with self._cond:
+            model.state = state
+            self._cond.notify_all()
+
+    def evict_idle(self, max_idle_seconds):
+        """Evict resident models nobody has used for `max_idle_seconds`."""
+        cutoff = time.time() - max_idle_seconds
+        with self._cond:
+            victims = [m for m in self._models.values()
+                       if m.state == RESIDENT and m.users == 0 and m.last_used < cutoff]
+            for victim in victims:
+                victim.state = EVICTING
+        for victim in victims:
+            self._evict(victim)
+        return [victim.name for victim in victims]
+
+    def status(self):
+        now = time.time()
+        with self._cond:
+            return {
+                "budget_mb": self.budget_mb,
+                "used_mb": round(self._used_mb(), 1),
+                "models": {name: m.to_dict(now) for name, m in self._models.items()},
+            }
+
+
+class ResidentApp:
+    """
+    ASGI wrapper that keeps a model resident for the duration of HTTP
+    requests to the wrapped app. With `paths`, only requests to those routes
+    (relative to the mount) need the model; CORS preflights never do.
+    """
+
+    def __init__(self, app, manager, name, paths=None):
+        self.app = app
+        self.manager = manager
+        self.name = name
+        self.paths = set(paths) if paths is not None else None
+
+    def _needs_model(self, scope):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            return False
+        if self.paths is None:
+            return True
+        path, root = scope["path"], scope.get("root_path", "")
+        if root and path.startswith(root):
+            path = path[len(root):]
+        return path in self.paths
+
+    async def __call__(self, scope, receive, send):
+        if not self._needs_model(scope):
+            await self.app(scope, receive, send)
+            return
+        # loading can take a while; keep the event loop free
+        await run_in_threadpool(self.manager.acquire, self.name)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.manager.release(self.name)
@@ -0,0 +1,116 @@
+"""
+One server for both exhibits on a single machine.
+
+    cd host
+    uvicorn serve:app --port 8000
+
+    /wordweaver/...    WordWeaver backend   (WordWeaver/wordweaver-backend/main.py)
+    /pixelpainter/...  PixelPainter backend (PixelPainter/backend/api.py)
+    /models            which model is resident, and how much memory it takes
+
+Both models share HOST_MODEL_BUDGET_MB of GPU memory. A model is loaded
+when a request needs it and idle models are evicted least-recently-used
+first: SD1.5 is moved to CPU RAM, while the 8-bit Llama is dropped and
+reloaded from disk (bitsandbytes weights cannot be moved off the GPU).
+"""
+import os
+import sys
+import threading
+import time
+from fastapi import FastAPI
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(HOST_DIR)
+sys.path[:0] = [
+    os.path.join(ROOT_DIR, "WordWeaver", "wordweaver-backend"),
+    os.path.join(ROOT_DIR, "PixelPainter", "backend"),
+]
+
+import api as pixelpainter_api
+import generate_steps
+import llm_core
+import main as wordweaver_api
+from residency import ResidencyManager, ResidentApp, module_memory_mb
+
+# ---- residency settings ----
+# device memory for model weights; PixelPainter's job activations are budgeted
+# separately (PIXELPAINTER_GPU_BUDGET_MB)
+MODEL_BUDGET_MB = int(os.environ.get("HOST_MODEL_BUDGET_MB", "6000"))
+# first-load estimates; replaced by the measured footprint once loaded
+WORDWEAVER_MB = int(os.environ.get("HOST_WORDWEAVER_MB", "3600"))
+PIXELPAINTER_MB = int(os.environ.get("HOST_PIXELPAINTER_MB", "2200"))
+# also evict models nobody used for this long (0 = only when memory is needed)
+IDLE_SECONDS = int(os.environ.get("HOST_IDLE_SECONDS", "0"))
+IDLE_CHECK_SECONDS = 30
+
+residency = ResidencyManager(MODEL_BUDGET_MB)
+
+residency.register(
+    "wordweaver",
+    load=llm_core.load_model,
+    unload=llm_core.unload_model,
+    size_mb=WORDWEAVER_MB,
+    measure=lambda: llm_core.load_model().get_memory_footprint() / 2 ** 20,
+)
+
+
+def _pipeline_mb():
+    # measured on every load / restore; TAESD counts once a preview loaded it,
+    # the prompt-embedding cache at its size bound
+    pipe = generate_steps.load_pipeline()
+    modules = [pipe.unet, pipe.vae, pipe.text_encoder]
+    taesd = generate_steps.loaded_taesd()
+    if taesd is not None:
+        modules.append(taesd)
+    return module_memory_mb(*modules) + generate_steps.TEXT_CACHE_MB
+
+
+residency.register(
+    "pixelpainter",
+    load=generate_steps.restore_pipeline,
+    offload=generate_steps.offload_pipeline,
+    restore=generate_steps.restore_pipeline,
+    size_mb=PIXELPAINTER_MB,
+    measure=_pipeline_mb,
+)
+
+# PixelPainter holds the pipeline only while a batch is denoising, so polling
+# jobs and serving frames never page the model in
+generate_steps.residency_guard = lambda: residency.use("pixelpainter")
+
+app = FastAPI()
+# only the model endpoints page the Llama in (not e.g. the "/" health check)
+app.mount("/wordweaver", ResidentApp(
+    wordweaver_api.app, residency, "wordweaver",
+    paths=("/generate", "/embed", "/internal_forward"),
+))
+app.mount("/pixelpainter", pixelpainter_api.app)
+
+
+def _idle_janitor():
+    while True:
+        time.sleep(IDLE_CHECK_SECONDS)
+        try:
+            evicted = residency.evict_idle(IDLE_SECONDS)
+            if evicted:
+                print("Evicted idle models:", ", ".join(evicted))
+        except Exception as e:
+            print("Warning: idle eviction failed:", e)
+
+
+@app.on_event("startup")
+def start():
+    # mounted apps do not get their own startup events
+    pixelpainter_api.start_jobs()
+    if IDLE_SECONDS > 0:
+        threading.Thread(target=_idle_janitor, name="idle-models", daemon=True).start()
+
+
+@app.get("/models")
+def models():
+    return residency.status()
+
+
+@app.get("/")
+def root():
+    return {"status": "exhibit host running", "apps": ["/wordweaver", "/pixelpainter"]}